@@ -30,6 +30,8 @@ from qgis.PyQt import QtWidgets, QtCore, QtGui
 from qgis.gui import QgsProjectionSelectionWidget
 from qgis.core import (
     Qgis,
+    QgsApplication,
+    QgsTask,
     QgsProject,
     QgsVectorLayer,
     QgsFeature,
@@ -39,7 +41,51 @@ from qgis.core import (
     QgsVectorFileWriter,
 )
 
-from ..terramesh import MeshGrid
+from ..terramesh import MeshGrid, MeshGridCanceled
+
+class ConvertTask(QgsTask):
+    
+    #stage and progress within the stage; emitted from the thread of the task
+    stage_signal = QtCore.pyqtSignal(str, int, int)
+    
+    #share of each stage on the overall progress in percent (start, end); the tiles are either merged 
+    #or saved; hence, both are the last stage. Unknown stages span the whole progress.
+    stages = {"build":(0, 70), "snap":(70, 90), "merge":(90, 100), "save":(90, 100)}
+    
+    def __init__(self, dtm_path, mesh_path, max_error, cache_errors=False):
+        super(ConvertTask, self).__init__("Convert %s" % (os.path.basename(dtm_path)), QgsTask.CanCancel)
+        
+        self.dtm_path = dtm_path
+        self.mesh_path = mesh_path
+        self.max_error = max_error
+        self.cache_errors = cache_errors
+        self.exception = None
+    
+    def report(self, stage, done, total):
+        start, end = self.stages.get(stage, (0, 100))
+        self.setProgress(start + (end - start) * done / max(total, 1))
+        self.stage_signal.emit(stage, done, total)
+    
+    def run(self):
+        try:
+            #if requested, error maps are cached next to the mesh; converting the same dtm with another 
+            #max_error then skips their calculation. The cache takes 4 bytes per pixel of the dtm.
+            if self.cache_errors:
+                error_cache = os.path.dirname(self.mesh_path)
+            else:
+                error_cache = None
+            
+            tile_grid = MeshGrid(path=self.dtm_path, tile_size=512, max_error=self.max_error, 
+                                 progress=self.report, canceled=self.isCanceled, 
+                                 error_cache=error_cache)
+            tile_grid.snap_boundaries()
+            tile_grid.merge_tiles(opath=self.mesh_path)
+        except MeshGridCanceled:
+            return False
+        except Exception as e:
+            self.exception = e
+            return False
+        return True
 
 class ConvertDialog(QtWidgets.QDialog):
     
@@ -52,9 +98,9 @@ class ConvertDialog(QtWidgets.QDialog):
         self.icon_dir = icon_dir
 
         self.setWindowTitle("Convert DTM to mesh...")
-        self.resize(500, 150)
-        self.setMinimumSize(QtCore.QSize(500, 150))
-        self.setMaximumSize(QtCore.QSize(500, 150))
+        self.resize(500, 175)
+        self.setMinimumSize(QtCore.QSize(500, 175))
+        self.setMaximumSize(QtCore.QSize(500, 175))
         
         main_layout = QtWidgets.QVBoxLayout()
         
@@ -99,24 +145,38 @@ class ConvertDialog(QtWidgets.QDialog):
         error_layout.addWidget(error_label)
         error_layout.addWidget(self.error_line)
         
+        cache_layout = QtWidgets.QHBoxLayout()
+        self.cache_check = QtWidgets.QCheckBox("Cache error maps next to the mesh")
+        self.cache_check.setToolTip('Converting the same DTM again with another maximum error reuses the cached error maps. The cache takes 4 bytes per pixel of the DTM.')
+        self.cache_check.setChecked(False)
+        
+        cache_layout.addWidget(self.cache_check)
+        
         btn_layout = QtWidgets.QHBoxLayout()
         self.pbar_label = QtWidgets.QLabel("")
         self.pbar_label.setMinimumWidth(250)
         self.convert_btn = QtWidgets.QPushButton("Convert")
         self.convert_btn.setEnabled(False)
         self.convert_btn.clicked.connect(self.convert_dtm)
+        self.cancel_btn = QtWidgets.QPushButton("Cancel")
+        self.cancel_btn.setEnabled(False)
+        self.cancel_btn.clicked.connect(self.cancel_convert)
         
         # btn_layout.addStretch(1)
         btn_layout.addWidget(self.pbar_label)
         btn_layout.addStretch(1)
         btn_layout.addWidget(self.convert_btn)
+        btn_layout.addWidget(self.cancel_btn)
         
         self.pbar = QtWidgets.QProgressBar()
-        self.pbar.setMaximum(10)
+        self.pbar.setMaximum(100)
+        
+        self.convert_task = None
         
         main_layout.addLayout(dtm_layout)
         main_layout.addLayout(mesh_layout)
         main_layout.addLayout(error_layout)
+        main_layout.addLayout(cache_layout)
         main_layout.addLayout(btn_layout)
         main_layout.addWidget(self.pbar)
         main_layout.addStretch(1)
@@ -144,27 +204,53 @@ class ConvertDialog(QtWidgets.QDialog):
         mesh_path = self.mesh_line.text()
         max_error = float(self.error_line.text())
         
-        QtWidgets.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
+        #the conversion of large dtms takes hours; hence, it runs as QgsTask to keep QGIS responsive
+        self.convert_task = ConvertTask(dtm_path, mesh_path, max_error, cache_errors=self.cache_check.isChecked())
+        self.convert_task.progressChanged.connect(lambda progress: self.pbar.setValue(int(progress)))
+        self.convert_task.stage_signal.connect(self.update_stage)
+        self.convert_task.taskCompleted.connect(self.convert_completed)
+        self.convert_task.taskTerminated.connect(self.convert_terminated)
         
-        #TODO updates of text not properly working; processing might need to be transferred
-        #TODO to individual QThread; appaers to be blocking updates
         self.pbar_label.setText("Reading %s..." % (dtm_path))
-        self.pbar.setValue(1)
-        
-        self.pbar_label.setText("Simplifying tiles...")
-        tile_grid = MeshGrid(path=dtm_path, tile_size=512, max_error=max_error)
-        self.pbar.setValue(4)
-        
-        self.pbar_label.setText("Snapping boundary vertices...")
-        tile_grid.snap_boundaries()
-        self.pbar.setValue(7)
-        
-        self.pbar_label.setText("Merging tiles...")
-        tile_grid.merge_tiles(opath=mesh_path)
-        self.pbar.setValue(10)
+        self.pbar.setValue(0)
+        self.convert_btn.setEnabled(False)
+        self.cancel_btn.setEnabled(True)
         
-        self.pbar_label.setText("Saved mesh to %s." % (mesh_path))
-        QtWidgets.QApplication.restoreOverrideCursor()
+        QgsApplication.taskManager().addTask(self.convert_task)
+    
+    def update_stage(self, stage, done, total):
+        if stage == "build":
+            self.pbar_label.setText("Simplifying tiles (%i/%i)..." % (done, total))
+        elif stage == "snap":
+            self.pbar_label.setText("Snapping boundary vertices (%i/%i)..." % (done, total))
+        elif stage == "merge":
+            self.pbar_label.setText("Merging tiles (%i/%i)..." % (done, total))
+        elif stage == "save":
+            self.pbar_label.setText("Saving tiles (%i/%i)..." % (done, total))
+    
+    def cancel_convert(self):
+        if self.convert_task is not None:
+            self.pbar_label.setText("Canceling...")
+            self.cancel_btn.setEnabled(False)
+            self.convert_task.cancel()
+    
+    def convert_completed(self):
+        self.pbar.setValue(100)
+        self.pbar_label.setText("Saved mesh to %s." % (self.convert_task.mesh_path))
+        self.convert_finished()
+    
+    def convert_terminated(self):
+        if self.convert_task.exception is not None:
+            self.pbar_label.setText("Conversion failed: %s" % (self.convert_task.exception))
+        else:
+            self.pbar_label.setText("Conversion canceled.")
+        self.pbar.setValue(0)
+        self.convert_finished()
+    
+    def convert_finished(self):
+        self.convert_task = None
+        self.convert_btn.setEnabled(True)
+        self.cancel_btn.setEnabled(False)
 
     # def set_crs(self):
     #     if (self.gpkg_line.text() is not "") & (self.mesh_line.text() is not "") & (self.crs_widget.crs().isValid()):
@@ -33,15 +33,15 @@ import open3d as o3d
 import numpy as np
 # import imageio.v3 as iio
 from PIL import Image
-from osgeo import gdal
 import json
 import sys
 import urllib.request
-import glob
 import copy
 import webbrowser
 
 from collections import OrderedDict
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 from qgis.utils import iface
 
 from qgis.core import (QgsFeature,
@@ -77,7 +77,10 @@ from ..tools.VertexTool import VertexTool
 from ..tools.jsonImport import jsonImport
 
 from ..camera import Camera
-from ..helpers import create_point_3d, rot2alzeka, alzeka2rot, calc_hfov, calc_vfov
+from ..helpers import create_point_3d, rot2alzeka, alzeka2rot, calc_hfov, calc_vfov, read_tile_data, TileIndex, horizon_occlusion
+from ..tileformat import build_tile_index
+from ..heightfield import DtmRaycaster, BLOCKS_FILE
+from ..residency import TileResidency
 
 from ..tools.map_controller import OrbitFlightController
 from ..tools.img_controller import ImageController
@@ -101,6 +104,28 @@ class MainDialog(QtWidgets.QDialog):
         #will be set from monique.py
         self.camera_collection = None
         self.tiles_data = None
+        self.dtm_caster = None
+        self.dtm_pool = ThreadPoolExecutor(max_workers=1)
+        self.residency = None
+        
+        #memory budget in MB for the loaded tiles (geometry and textures) of the 3D canvas
+        self.tile_memory_budget = 1024
+        
+        #each tile is rendered with the coarsest level of detail whose error projects to less than
+        #lod_pixel_error pixels; finer levels are dropped if the visible tiles exceed lod_max_triangles
+        self.lod_pixel_error = 2.
+        self.lod_max_triangles = 4000000
+        
+        #tiles inside the frustum which are hidden behind the terrain in front of them are not rendered
+        self.occlusion_culling = True
+        
+        #the 3D canvas draws at most render_target_fps frames per second; draw requests in between are merged. 
+        #While the camera moves, frames are rendered with interaction_pixel_ratio; a frame with the full 
+        #pixel_ratio follows once the camera rested for render_settle_ms
+        self.render_target_fps = 30
+        self.render_pixel_ratio = 1
+        self.interaction_pixel_ratio = 0.5
+        self.render_settle_ms = 200
         self.initial_render = True
         self.project_pos_toggled = False
         self.temporary_camera = None
@@ -223,7 +248,7 @@ class MainDialog(QtWidgets.QDialog):
         self.obj_toolbar = QtWidgets.QToolBar()
         self.obj_toolbar.setIconSize(QtCore.QSize(24, 24))
 
-        self.obj_canvas = WgpuCanvas(parent=self)
+        self.obj_canvas = WgpuCanvas(parent=self, max_fps=self.render_target_fps)
         self.obj_canvas.setMinimumSize(QtCore.QSize(300, 16777215))
 
         self.obj_statusbar = QtWidgets.QStatusBar()
@@ -238,6 +263,15 @@ class MainDialog(QtWidgets.QDialog):
         self.obj_statusbar.addWidget(self.obj_status_fov)
         self.obj_statusbar.addWidget(self.obj_status_fov_edit)
         
+        self.obj_status_tiles = QtWidgets.QLabel()
+        self.obj_status_tiles.setText("Tiles")
+        self.obj_status_tiles_edit = QtWidgets.QLineEdit()
+        self.obj_status_tiles_edit.setEnabled(False)
+        self.obj_status_tiles_edit.setFixedWidth(140)
+        self.obj_status_tiles_edit.setFixedHeight(20)
+        self.obj_statusbar.addWidget(self.obj_status_tiles)
+        self.obj_statusbar.addWidget(self.obj_status_tiles_edit)
+        
         self.btn_reset_obj_canvas_camera = QtWidgets.QAction("Reset to default camera position.", self)
         self.btn_reset_obj_canvas_camera.setIcon(QtGui.QIcon(os.path.join(self.icon_dir, "zoom_to_extent.png")))
         self.btn_reset_obj_canvas_camera.triggered.connect(self.reset_obj_canvas_camera)
@@ -280,10 +314,14 @@ class MainDialog(QtWidgets.QDialog):
         self.btn_load_obj_canvas_camera.setEnabled(False)
         self.obj_toolbar.addAction(self.btn_load_obj_canvas_camera)
 
-        self.obj_renderer = gfx.WgpuRenderer(self.obj_canvas, pixel_ratio=1)
+        self.obj_renderer = gfx.WgpuRenderer(self.obj_canvas, pixel_ratio=self.render_pixel_ratio)
         self.obj_renderer.add_event_handler(self.save_camera_view, "key_down")
         self.obj_scene = gfx.Scene()
         self.obj_stats = gfx.Stats(viewport=self.obj_renderer)
+        
+        self.settle_timer = QtCore.QTimer(self)
+        self.settle_timer.setSingleShot(True)
+        self.settle_timer.timeout.connect(self.obj_canvas.request_draw)
 
         self.background = gfx.Background(None, gfx.BackgroundMaterial([1, 1, 1, 1]))
         self.obj_scene.add(self.background)
@@ -952,63 +990,55 @@ class MainDialog(QtWidgets.QDialog):
         
         self.o3d_scene = o3d.t.geometry.RaycastingScene()
         
-        for tx, tile in enumerate(self.tiles_data["tiles"]):
-            
-            self.msg_box.setValue(tx+1)
-            
-            geom_path = os.path.normpath(os.path.join(self.tiles_data["tile_dir"], "%s.ply" % (tile["tid"])))
-            # op_path = os.path.normpath(os.path.join(self.tiles_data["op_dir"], "%s.jpg" % (tile["tid"])))
-            op_paths = glob.glob(os.path.normpath(os.path.join(self.tiles_data["op_dir"], "%s.*" % (tile["tid"]))))
-                        
-            if len(op_paths) == 1:
-                op_path = op_paths[0]            
-            else:
-                op_path = None     
-                        
-            if os.path.exists(geom_path):
-                
-                tile_mesh = o3d.io.read_triangle_mesh(geom_path)
-                verts = np.asarray(tile_mesh.vertices).astype(np.float32)
-                
-                u = (verts[:, 0] - tile["min_xyz"][0])/(tile["max_xyz"][0] - tile["min_xyz"][0])
-                v = (verts[:, 1] - tile["min_xyz"][1])/(tile["max_xyz"][1] - tile["min_xyz"][1])
-                uv = np.hstack((u.reshape(-1, 1), v.reshape(-1, 1)))
-                
-                verts -= self.min_xyz
-                faces = np.asarray(tile_mesh.triangles).astype(np.uint32)
-                
-                self.o3d_scene.add_triangles(verts, faces)
-                                    
-                # print("Loading mesh...")
-                mesh_geom = gfx.geometries.Geometry(indices=faces, 
-                                                    positions=verts,
-                                                    texcoords=uv.astype(np.float32),
-                                                    tid=[int(tile["tid_int"])])
-                if op_path is not None:
-                    if os.path.exists(op_path):
-                        img_ds = gdal.Open(op_path)
-                        img_h = img_ds.RasterYSize
-                        img_w = img_ds.RasterXSize
-                        img_arr = np.zeros((img_h, img_w, 3), dtype=np.uint8)
-                                    
-                        for bx in range(3):
-                            bx_arr = img_ds.GetRasterBand(bx+1).ReadAsArray()
-                            img_arr[:, :, bx] = bx_arr
-                                        
-                        img_arr = np.flipud(img_arr)
-                        tex = gfx.Texture(img_arr, dim=2, generate_mipmaps=True)
-
-                        mesh_material = gfx.MeshBasicMaterial(map=tex, side="FRONT", pick_write=True)
-                    else:
-                        mesh_material = gfx.MeshNormalMaterial(side="FRONT", pick_write=True)
-                else:
-                    mesh_material = gfx.MeshNormalMaterial(side="FRONT", pick_write=True)
-            
-                #add lowest resolution material to mesh at startup
-                mesh = gfx.Mesh(mesh_geom, mesh_material, visible=False)
-                mesh.add_event_handler(self.zoom_to_point, "click")
-                self.terrain.add(mesh)
-            
+        #rays are intersected with the source DTM if it is still available; otherwise with the tiles. The 
+        #min/max of the blocks of the DTM are read from the project; projects without them get them 
+        #from a background thread and use the tiles until then.
+        dtm_path = self.tiles_data.get("dtm_path")
+        if (dtm_path is not None) and os.path.exists(dtm_path):
+            block_path = os.path.join(os.path.dirname(self.tiles_data["tile_dir"]), BLOCKS_FILE)
+            self.dtm_caster = DtmRaycaster(dtm_path, origin=self.min_xyz, block_path=block_path, build=False)
+            if not self.dtm_caster.ready():
+                self.dtm_pool.submit(self.dtm_caster.init_block_levels, block_path)
+        else:
+            self.dtm_caster = None
+        
+        #tiles.json of a MeshGrid with levels of detail stores each level in mesh/<olvl>; 
+        #older projects have the tiles directly in mesh/ and are always stored as ply
+        tile_fmt = self.tiles_data.get("format", "ply")
+        if "lods" in self.tiles_data.keys():
+            self.tile_levels = [lod["olvl"] for lod in self.tiles_data["lods"]]
+            tile_dirs = {olvl:os.path.join(self.tiles_data["tile_dir"], olvl) for olvl in self.tile_levels}
+        else:
+            self.tile_levels = ["1"]
+            tile_dirs = {"1":self.tiles_data["tile_dir"]}
+        
+        #tiles are loaded once they become visible for the first time and dropped again if they were not 
+        #visible for the longest time and the memory budget is exceeded; until then a placeholder is shown
+        read_func = partial(read_tile_data, tile_fmt=tile_fmt, op_dir=self.tiles_data["op_dir"], min_xyz=self.min_xyz)
+        
+        if self.residency is not None:
+            self.residency.shutdown()
+        self.residency = TileResidency(self.tiles_data, read_func, tile_dirs, self.min_xyz, budget_mb=self.tile_memory_budget, 
+                                       workers=min(8, os.cpu_count() or 1), on_error=self.tile_error)
+        
+        #the n-th mesh of terrain_meshes is the tile with tid_int n
+        self.terrain_meshes = self.residency.meshes
+        for mesh in self.terrain_meshes:
+            mesh.add_event_handler(self.zoom_to_point, "click")
+        
+        self.init_culling()
+        self.init_terrain_tree()
+        
+        #without the DTM (or until its blocks are ready), rays are intersected with the tiles; hence, the 
+        #geometry of all tiles is still required for the raycasting scene. It is decoded by a pool of threads 
+        #without the textures; map() returns the tiles in the order of tiles.json.
+        if (self.dtm_caster is None) or (not self.dtm_caster.ready()):
+            with ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1)) as pool:
+                for tx, tile_data in enumerate(pool.map(partial(read_func, tile_dir=tile_dirs[self.tile_levels[0]], texture=False), self.tiles_data["tiles"])):
+                    self.msg_box.setValue(tx+1)
+                    if tile_data is not None:
+                        self.o3d_scene.add_triangles(tile_data["scene_verts"], tile_data["faces"])
+        
         self.obj_scene.add(self.terrain)
         local_cx = self.tiles_data["cx"] - self.min_xyz
                 
@@ -1033,8 +1063,189 @@ class MainDialog(QtWidgets.QDialog):
         self.mono_tool.set_minxyz(self.min_xyz)
         self.mono_vertex_tool.set_minxyz(self.min_xyz)
                        
-        self.mono_tool.set_scene(self.o3d_scene)
-        self.mono_vertex_tool.set_scene(self.o3d_scene)
+        self.mono_tool.set_scene(self.o3d_scene, self.dtm_caster)
+        self.mono_vertex_tool.set_scene(self.o3d_scene, self.dtm_caster)
+    
+    def tile_error(self, tid_int, error):
+        tid = self.residency.tiles[tid_int]["tid"]
+        self.msg_bar.pushMessage("Error", "Could not load tile %s: %s" % (tid, error), level=Qgis.Warning, duration=3)
+    
+    def init_culling(self):
+        
+        #bounding boxes of all tiles relative to min_xyz; rows are in the order of tiles.json
+        tiles = self.tiles_data["tiles"]
+        self.tile_tids = np.array([int(tile["tid_int"]) for tile in tiles], dtype=np.int64)
+        self.tile_rows = np.argsort(self.tile_tids)
+        self.tile_min = np.array([tile["min_xyz"] for tile in tiles], dtype=np.float64).reshape(-1, 3) - self.min_xyz
+        self.tile_max = np.array([tile["max_xyz"] for tile in tiles], dtype=np.float64).reshape(-1, 3) - self.min_xyz
+        
+        #only tiles without gaps occlude others; older projects do not flag them; hence, none occludes
+        self.tile_full = np.array([tile.get("full", False) for tile in tiles], dtype=bool)
+        
+        self.tile_visible = np.zeros(len(tiles), dtype=bool)
+        self.tile_occluded = np.zeros(len(tiles), dtype=bool)
+        self.last_frustum = None
+        
+        #geometric error and number of triangles of each tile in each level of detail; tiles might be missing
+        #in single levels. Older projects only have one level without any error.
+        nr_lvls = len(self.tile_levels)
+        self.tile_lod_errors = np.full((len(tiles), nr_lvls), np.inf)
+        self.tile_lod_nrt = np.zeros((len(tiles), nr_lvls), dtype=np.int64)
+        
+        for tx, tile in enumerate(tiles):
+            if "lods" not in tile.keys():
+                self.tile_lod_errors[tx, :] = 0
+                continue
+            for lx, olvl in enumerate(self.tile_levels):
+                if olvl in tile["lods"].keys():
+                    self.tile_lod_errors[tx, lx] = tile["lods"][olvl].get("max_error") or 0
+                    self.tile_lod_nrt[tx, lx] = tile["lods"][olvl]["nrt"]
+        
+        self.tile_lod_available = np.isfinite(self.tile_lod_errors)
+        self.tile_lvl_ix = np.zeros(len(tiles), dtype=np.int64)
+    
+    def frustum_planes(self, frustum):
+        corners_flat = frustum.reshape((-1, 3))
+                
+        corners_by_plane = np.stack([
+            corners_flat[[0, 3, 7, 4], :],
+            corners_flat[[5, 6, 2, 1], :],
+            corners_flat[[3, 2, 6, 7], :],
+            corners_flat[[4, 5, 1, 0], :],
+            corners_flat[[1, 2, 3, 0], :],
+            corners_flat[[4, 7, 6, 5], :]], axis=0)
+                    
+        # planes in normal form (normals point away from the frustum area)
+        normals = np.cross(
+            corners_by_plane[:, 0, :] - corners_by_plane[:, 3, :],
+            corners_by_plane[:, 2, :] - corners_by_plane[:, 3, :]
+        )
+        
+        normals /= np.linalg.norm(normals, axis=-1)[:, None] # normal normals ^_^
+        offsets = np.sum(normals * corners_by_plane[:, 0, :], axis=-1)  #d=n*r0; r0 some point on the plane
+        
+        return normals, offsets
+    
+    def init_terrain_tree(self):
+        
+        #quadtree of groups over the r_c grid of the tiles; each group holds the groups of its (up to) four
+        #child blocks, the groups of the leaves hold the meshes. Older projects do not have the index in 
+        #tiles.json; it is then created from the tiles.
+        if "index" not in self.tiles_data.keys():
+            self.tiles_data["index"] = build_tile_index(self.tiles_data["tiles"])
+        self.tile_index = TileIndex(self.tiles_data)
+        
+        self.terrain_nodes = [gfx.Group(visible=False) for _ in self.tile_index.children]
+        for nix, children in enumerate(self.tile_index.children):
+            for cix in children:
+                self.terrain_nodes[nix].add(self.terrain_nodes[cix])
+            if len(children) == 0:
+                tid_int = self.tile_index.order[self.tile_index.first[nix]]
+                self.terrain_nodes[nix].add(self.terrain_meshes[tid_int])
+        
+        self.terrain.add(self.terrain_nodes[0])
+        
+        #True if a node and all nodes below it are visible; fully inside subtrees are then shown without
+        #walking through them again
+        self.node_all_visible = np.zeros(len(self.terrain_nodes), dtype=bool)
+    
+    def show_subtree(self, nix):
+        self.terrain_nodes[nix].visible = True
+        for cix in self.tile_index.children[nix]:
+            if not self.node_all_visible[cix]:
+                self.show_subtree(cix)
+        self.node_all_visible[nix] = True
+    
+    def cull_node(self, nix, test_node, visible_nodes):
+        result = test_node(nix)
+        children = self.tile_index.children[nix]
+        
+        #subtrees outside of the frustum are hidden at their root; the nodes below keep their state
+        if result == TileIndex.OUTSIDE:
+            self.terrain_nodes[nix].visible = False
+            self.node_all_visible[nix] = False
+            return
+        
+        if (result == TileIndex.INSIDE) or (len(children) == 0):
+            visible_nodes.append(nix)
+            if not self.node_all_visible[nix]:
+                self.show_subtree(nix)
+            return
+        
+        self.terrain_nodes[nix].visible = True
+        for cix in children:
+            self.cull_node(cix, test_node, visible_nodes)
+        self.node_all_visible[nix] = all(self.node_all_visible[cix] for cix in children)
+    
+    def cull_tiles(self, frustum):
+        
+        #the bounds of the index are global; hence, the offsets of the planes are shifted by min_xyz
+        normals, offsets = self.frustum_planes(frustum)
+        test_node = self.tile_index.frustum_test(normals, offsets + normals @ self.min_xyz)
+        
+        visible_nodes = []
+        self.cull_node(0, test_node, visible_nodes)
+        
+        #tiles below a node are a contiguous range of the leaf order of the index
+        tile_visible = np.zeros(len(self.tile_tids), dtype=bool)
+        for nix in visible_nodes:
+            first = self.tile_index.first[nix]
+            tile_visible[self.tile_rows[self.tile_index.order[first:first+self.tile_index.count[nix]]]] = True
+        
+        return tile_visible
+    
+    def occlude_tiles(self, tile_visible):
+        
+        #horizon test of the tiles within the frustum; occluded tiles are hidden at their mesh as the groups 
+        #of the quadtree only reflect the frustum
+        vix = np.nonzero(tile_visible)[0]
+        occluded = np.zeros(len(tile_visible), dtype=bool)
+        if self.occlusion_culling:
+            occluded[vix] = horizon_occlusion(self.obj_camera.world.position, self.tile_min[vix], self.tile_max[vix], self.tile_full[vix])
+        
+        for tx in np.nonzero(occluded != self.tile_occluded)[0]:
+            self.terrain_meshes[self.tile_tids[tx]].visible = not occluded[tx]
+        self.tile_occluded = occluded
+        
+        self.obj_status_tiles_edit.setText("%i (%i occluded)" % (np.sum(tile_visible & ~occluded), np.sum(occluded)))
+        
+        return tile_visible & ~occluded
+    
+    def select_lods(self, tile_visible):
+        
+        #screen space error; the geometric error of a level projected to the image plane at the distance 
+        #between the camera and the closest point of the bounding box of the tile
+        cam_pos = self.obj_camera.world.position
+        canvas_w, canvas_h = self.obj_canvas.get_logical_size()
+        px_per_rad = max(canvas_w, canvas_h) / (2 * np.tan(np.deg2rad(self.obj_camera.fov) / 2))
+        
+        vix = np.nonzero(tile_visible)[0]
+        closest = np.clip(cam_pos, self.tile_min[vix], self.tile_max[vix])
+        dist = np.maximum(np.linalg.norm(closest - cam_pos, axis=1), 1e-6)
+        
+        sse = self.tile_lod_errors[vix] * (px_per_rad / dist)[:, None]
+        allowed = (sse <= self.lod_pixel_error) & self.tile_lod_available[vix]
+        
+        #levels are sorted from the finest to the coarsest one; without any allowed level the finest 
+        #available one is used
+        nr_lvls = len(self.tile_levels)
+        coarsest = nr_lvls - 1 - np.argmax(allowed[:, ::-1], axis=1)
+        finest = np.argmax(self.tile_lod_available[vix], axis=1)
+        lvl_ix = np.where(np.any(allowed, axis=1), coarsest, finest)
+        
+        #the most distant tiles are coarsened first until the triangles of all visible tiles meet the cap
+        nr_tris = np.sum(self.tile_lod_nrt[vix, lvl_ix])
+        if nr_tris > self.lod_max_triangles:
+            for tx in np.argsort(-dist):
+                avail_ix = np.nonzero(self.tile_lod_available[vix[tx]])[0]
+                nr_tris -= self.tile_lod_nrt[vix[tx], lvl_ix[tx]] - self.tile_lod_nrt[vix[tx], avail_ix[-1]]
+                lvl_ix[tx] = avail_ix[-1]
+                if nr_tris <= self.lod_max_triangles:
+                    break
+        
+        tile_lvl_ix = np.zeros(len(tile_visible), dtype=np.int64)
+        tile_lvl_ix[vix] = lvl_ix
+        return tile_lvl_ix
     
     def animate(self): 
         cam_state = self.obj_camera.get_state()
@@ -1044,54 +1255,42 @@ class MainDialog(QtWidgets.QDialog):
                         
             # cam_pos = self.obj_camera.local.position
             frustum = self.obj_camera.frustum
-            corners_flat = frustum.reshape((-1, 3))
-                    
-            corners_by_plane = np.stack([
-                corners_flat[[0, 3, 7, 4], :],
-                corners_flat[[5, 6, 2, 1], :],
-                corners_flat[[3, 2, 6, 7], :],
-                corners_flat[[4, 5, 1, 0], :],
-                corners_flat[[1, 2, 3, 0], :],
-                corners_flat[[4, 7, 6, 5], :]], axis=0)
-                        
-            # planes in normal form (normals point away from the frustum area)
-            normals = np.cross(
-                corners_by_plane[:, 0, :] - corners_by_plane[:, 3, :],
-                corners_by_plane[:, 2, :] - corners_by_plane[:, 3, :]
-            )
-            
-            normals /= np.linalg.norm(normals, axis=-1)[:, None] # normal normals ^_^
-            # offset = np.sum(normals * corners_by_plane[:, 3, :], axis=-1)  #d=n*r0; r0 some point on the plane            
-            
-            # end_time = time.time()
-            # print("%.6f" % (end_time - start_time))
-            
-            # start_time = time.time()
-            for tile in self.tiles_data["tiles"]:
-                result = "INSIDE"
-                tile_cx = np.array(tile["cx_r"][:3]) - self.min_xyz
+            
+            #the visibility of the tiles only changes with the frustum; hence, culling is skipped for frames
+            #with an unchanged camera; e.g. when only gcps are added or tiles finished loading
+            camera_moved = (self.last_frustum is None) or (not np.array_equal(frustum, self.last_frustum))
+            if camera_moved:
+                self.last_frustum = frustum.copy()
                 
-                for nx in range(6):
-                    
-                    #normal distance between any point on the plane and the sphere center                
-                    #https://www.w3schools.blog/distance-of-a-point-from-a-plane
-                    #simplest frustum culling technique; renderes more tiles than actually visible;
-                    cx_c_vec = tile_cx - corners_by_plane[nx, 0, :]                    
-                    cx_dist = np.dot(cx_c_vec, normals[nx, :])
-                                    
-                    if cx_dist > tile["cx_r"][-1]:
-                        result="OUTSIDE"
-                        break
-                                    
-                # #first tile added to group has tid_pygfx = 0; Hence, we can use this id to directly access the 
-                # #respective children within the list; no need for an additional for loop;
-                if result == "INSIDE":
-                    self.terrain.children[int(tile["tid_int"])].visible = True
-                else:
-                    self.terrain.children[int(tile["tid_int"])].visible = False
-                    
+                #culling sets the visibility of the groups of the quadtree; only nodes with a changed 
+                #visibility are touched
+                self.tile_visible = self.occlude_tiles(self.cull_tiles(frustum))
+                self.tile_lvl_ix = self.select_lods(self.tile_visible)
+            
+            visible_tids = self.tile_tids[self.tile_visible]
+            visible_lvls = [self.tile_levels[lx] for lx in self.tile_lvl_ix[self.tile_visible]]
+            
+            #visible tiles which are not loaded yet (or loaded in another level of detail) are requested from 
+            #the residency manager; as long as tiles are loading, further frames are requested to show them
+            tiles_loading = self.residency.update(visible_tids, visible_lvls)
+            
+            #reduced resolution while the camera moves; every move restarts the timer which requests the 
+            #full resolution frame once the camera rests. The frame itself does not move the camera; hence, 
+            #it is rendered with render_pixel_ratio.
+            if camera_moved and not self.initial_render:
+                pixel_ratio = self.interaction_pixel_ratio
+                self.settle_timer.start(self.render_settle_ms)
+            else:
+                pixel_ratio = self.render_pixel_ratio
+            
+            if self.obj_renderer.pixel_ratio != pixel_ratio:
+                self.obj_renderer.pixel_ratio = pixel_ratio
+            
             self.obj_renderer.render(self.obj_scene, self.obj_camera, flush=True) #flash=True if fps not used anymore
             
+            if tiles_loading:
+                self.obj_canvas.request_draw(self.animate)
+            
             if self.initial_render is True:
                 self.msg_box.setValue(len(self.tiles_data["tiles"])+1)
                 QtWidgets.QApplication.instance().restoreOverrideCursor()
@@ -1806,14 +2005,14 @@ class MainDialog(QtWidgets.QDialog):
         self.img_canvas.setMapTool(self.img_picker_tool)
         
         #GCP picking ib object space
-        for mesh in self.terrain.children:
+        for mesh in self.terrain_meshes:
             mesh.add_event_handler(self.mesh_picking, "click")
     
     def gcp_selected(self, data):
         self.dlg_orient.gcp_selected(data, 1)
 
     def deactivate_gcp_picking(self):
-        for mesh in self.terrain.children:
+        for mesh in self.terrain_meshes:
             mesh.remove_event_handler(self.mesh_picking, "click")
         self.img_canvas.setMapTool(self.img_pan_tool)
         
@@ -1833,7 +2032,8 @@ class MainDialog(QtWidgets.QDialog):
         face_vertex_ix = event.pick_info["world_object"].geometry.indices.data[face_ix, :]
         face_vertex_pos = event.pick_info["world_object"].geometry.positions.data[face_vertex_ix, :]
         
-        click_pos = np.sum(face_vertex_pos*face_coords, axis=0) 
+        #tiles from the binary container are positioned relative to their own origin
+        click_pos = np.sum(face_vertex_pos*face_coords, axis=0) + event.pick_info["world_object"].local.position
         click_pos_global = click_pos + self.min_xyz
         return click_pos, click_pos_global
     
@@ -1982,12 +2182,12 @@ class MainDialog(QtWidgets.QDialog):
         self.img_rubber.setColor(QColor(252,15,192, 255))
         self.img_rubber.setIconSize(15)
         
-        for mesh in self.terrain.children:
+        for mesh in self.terrain_meshes:
             mesh.add_event_handler(self.reproject_pos, "pointer_move")
     
     def untoggle_project_mouse_pos(self):       
         if self.project_pos_toggled:
-            for mesh in self.terrain.children:
+            for mesh in self.terrain_meshes:
                 mesh.remove_event_handler(self.reproject_pos, "pointer_move")
             self.project_pos_toggled = False
             self.img_rubber.reset()
@@ -675,9 +675,14 @@ class OrientDialog(QtWidgets.QDialog):
 
             ray_offset = np.arange(250, -250, -1).reshape(-1, 1)
             pnts_along_ray = prc + ray_offset*plane_pnts_dir
-            pnts_along_ray_o3d = o3d.core.Tensor(pnts_along_ray, dtype=o3d.core.Dtype.Float32)
-            dist2mesh = self.parent.o3d_scene.compute_signed_distance(pnts_along_ray_o3d)
-            pnts_profile = pnts_along_ray[:, 2] - dist2mesh.numpy()
+            
+            #terrain heights below the points along the ray; taken from the DTM if available
+            if self.parent.dtm_caster is not None:
+                pnts_profile = self.parent.dtm_caster.heights(pnts_along_ray[:, :2])
+            else:
+                pnts_along_ray_o3d = o3d.core.Tensor(pnts_along_ray, dtype=o3d.core.Dtype.Float32)
+                dist2mesh = self.parent.o3d_scene.compute_signed_distance(pnts_along_ray_o3d)
+                pnts_profile = pnts_along_ray[:, 2] - dist2mesh.numpy()
 
             return ray_offset, pnts_profile, prc, plane_pnts_dir
         
@@ -0,0 +1,350 @@
+import os
+import numpy as np
+from osgeo import gdal
+from collections import OrderedDict
+
+gdal.UseExceptions()
+
+def cell_min_max(arr_h):
+
+    #a cell spans 2x2 pixel centers; cells with any nodata corner are not part of the surface and
+    #get an empty height range
+    corners = np.stack([arr_h[:-1, :-1], arr_h[:-1, 1:], arr_h[1:, :-1], arr_h[1:, 1:]], axis=0)
+    cell_min = np.min(corners, axis=0)
+    cell_max = np.max(corners, axis=0)
+    cell_min[np.isnan(cell_min)] = np.inf
+    cell_max[np.isnan(cell_max)] = -np.inf
+    return cell_min, cell_max
+
+def reduce_min_max(arr_min, arr_max):
+
+    #next coarser level of the min/max mipmap; odd sizes are padded with empty ranges
+    nr, nc = arr_min.shape
+    pr, pc = nr + nr % 2, nc + nc % 2
+
+    pad_min = np.full((pr, pc), np.inf)
+    pad_max = np.full((pr, pc), -np.inf)
+    pad_min[:nr, :nc] = arr_min
+    pad_max[:nr, :nc] = arr_max
+
+    red_min = pad_min.reshape(pr//2, 2, pc//2, 2).min(axis=(1, 3))
+    red_max = pad_max.reshape(pr//2, 2, pc//2, 2).max(axis=(1, 3))
+    return red_min, red_max
+
+def min_max_mipmap(arr_min, arr_max):
+    levels = [(arr_min, arr_max)]
+    while max(levels[-1][0].shape) > 1:
+        levels.append(reduce_min_max(*levels[-1]))
+    return levels
+
+def slab(o, d, lo, hi, t_min, t_max):
+
+    #parameter range of the ray o + t*d within [lo, hi] of one axis
+    if d == 0:
+        if (o < lo) or (o > hi):
+            return t_max, t_min
+        return t_min, t_max
+
+    t_lo = (lo - o) / d
+    t_hi = (hi - o) / d
+    if t_lo > t_hi:
+        t_lo, t_hi = t_hi, t_lo
+    return max(t_min, t_lo), min(t_max, t_hi)
+
+def bilinear_hit(o, d, h, t_in, t_out):
+
+    #exact intersection of the ray with the bilinear patch of one cell; o and d are given in cell
+    #coordinates (a, b, z) with a, b in [0, 1]; h holds the heights h00, h01, h10, h11
+    h00, h01, h10, h11 = h
+    p = h01 - h00
+    q = h10 - h00
+    r = h00 - h01 - h10 + h11
+
+    c2 = -r * d[0] * d[1]
+    c1 = d[2] - p * d[0] - q * d[1] - r * (o[0] * d[1] + o[1] * d[0])
+    c0 = o[2] - h00 - p * o[0] - q * o[1] - r * o[0] * o[1]
+
+    #ray starts below the surface of the cell
+    if c0 + c1 * t_in + c2 * t_in**2 <= 0:
+        return t_in
+
+    if abs(c2) < 1e-12:
+        if c1 == 0:
+            return None
+        roots = [-c0 / c1]
+    else:
+        disc = c1**2 - 4 * c2 * c0
+        if disc < 0:
+            return None
+
+        #numerically stable roots of the quadratic
+        sq = np.sqrt(disc)
+        k = -0.5 * (c1 + np.copysign(sq, c1))
+        roots = [k / c2]
+        if k != 0:
+            roots.append(c0 / k)
+
+    roots = [t for t in roots if (t >= t_in) and (t <= t_out)]
+    if len(roots) == 0:
+        return None
+    return min(roots)
+
+#min/max of the blocks of the DTM written next to tiles.json; see DtmRaycaster.init_block_levels
+BLOCKS_FILE = "dtm_blocks.npz"
+
+class DtmRaycaster():
+
+    def __init__(self, path, origin=None, block_size=64, cache_blocks=256, block_path=None, build=True):
+
+        self.path = path
+        self.ds = gdal.Open(path)
+
+        self.gt = self.ds.GetGeoTransform()
+        if (self.gt[2] != 0) or (self.gt[4] != 0):
+            raise ValueError("Rotated rasters are not supported.")
+
+        self.band = self.ds.GetRasterBand(1)
+        self.nodata = self.band.GetNoDataValue()
+
+        self.nr_rows = self.ds.RasterYSize
+        self.nr_cols = self.ds.RasterXSize
+
+        #rays and heights are given relative to the origin; e.g., min_xyz of the mesh in the 3D canvas
+        if origin is None:
+            origin = np.zeros(3)
+        self.origin = np.array(origin, dtype=np.float64)
+
+        #block_size must be a power of two; the mipmap levels of a block then continue seamlessly
+        #with the levels of the block grid
+        self.block_size = block_size
+        self.block_lvl = int(np.log2(block_size))
+        if 2**self.block_lvl != block_size:
+            raise ValueError("block_size must be a power of two.")
+
+        self.cache_blocks = cache_blocks
+        self.cache = OrderedDict()
+
+        self.nr_cell_rows = self.nr_rows - 1
+        self.nr_cell_cols = self.nr_cols - 1
+        self.nr_block_rows = int(np.ceil(self.nr_cell_rows / block_size))
+        self.nr_block_cols = int(np.ceil(self.nr_cell_cols / block_size))
+
+        #the min/max of the blocks requires reading the whole raster; hence, they are loaded from block_path 
+        #if available. Without build, the caster is not ready until init_block_levels is called; e.g. by a 
+        #background thread.
+        self.block_levels = None
+        if (block_path is None) or (not self.load_block_levels(block_path)):
+            if build:
+                self.init_block_levels(block_path)
+
+    def ready(self):
+        return self.block_levels is not None
+
+    def read_window(self, min_r, min_c, nr_rows, nr_cols, band=None):
+
+        #windows reaching beyond the raster are padded with nodata
+        if band is None:
+            band = self.band
+
+        win = np.full((nr_rows, nr_cols), np.nan)
+        max_r = min(min_r + nr_rows, self.nr_rows)
+        max_c = min(min_c + nr_cols, self.nr_cols)
+
+        arr = band.ReadAsArray(min_c, min_r, max_c - min_c, max_r - min_r).astype(np.float64)
+        if self.nodata is not None:
+            arr[arr == self.nodata] = np.nan
+
+        win[:max_r - min_r, :max_c - min_c] = arr
+        return win
+
+    def init_block_levels(self, block_path=None):
+
+        #min/max of each block; the raster is streamed in strips of one block row to keep the memory
+        #footprint independent of the size of the raster. The strips are read from a separate handle 
+        #of the dataset; hence, this can run in a thread other than the one casting the rays.
+        band = gdal.Open(self.path).GetRasterBand(1)
+
+        bs = self.block_size
+        block_min = np.full((self.nr_block_rows, self.nr_block_cols), np.inf)
+        block_max = np.full((self.nr_block_rows, self.nr_block_cols), -np.inf)
+
+        for br in range(self.nr_block_rows):
+            strip = self.read_window(br*bs, 0, bs+1, self.nr_block_cols*bs+1, band=band)
+            strip_min, strip_max = cell_min_max(strip)
+            block_min[br, :] = strip_min.reshape(bs, self.nr_block_cols, bs).min(axis=(0, 2))
+            block_max[br, :] = strip_max.reshape(bs, self.nr_block_cols, bs).max(axis=(0, 2))
+
+        self.set_block_levels(block_min, block_max)
+
+        if block_path is not None:
+            self.save_block_levels(block_path, block_min, block_max)
+
+    def set_block_levels(self, block_min, block_max):
+
+        #block_levels is set last as it marks the caster as ready
+        levels = min_max_mipmap(block_min, block_max)
+        self.top_lvl = self.block_lvl + len(levels) - 1
+
+        self.min_h = np.min(block_min)
+        self.max_h = np.max(block_max)
+        self.block_levels = levels
+
+    def save_block_levels(self, block_path, block_min, block_max):
+        
+        #the file is only a cache; e.g. a read only project directory does not prevent the raycasting
+        try:
+            with open(block_path, "wb") as f:
+                np.savez(f, block_min=block_min, block_max=block_max, block_size=self.block_size, 
+                         raster_size=[self.nr_rows, self.nr_cols], gt=self.gt)
+        except OSError:
+            pass
+
+    def load_block_levels(self, block_path):
+
+        #blocks of another raster or block size are not used
+        if not os.path.exists(block_path):
+            return False
+
+        with np.load(block_path) as blocks:
+            if (int(blocks["block_size"]) != self.block_size) or \
+               (blocks["raster_size"].tolist() != [self.nr_rows, self.nr_cols]) or \
+               (not np.allclose(blocks["gt"], self.gt)):
+                return False
+            self.set_block_levels(blocks["block_min"], blocks["block_max"])
+        return True
+
+    def block(self, br, bc):
+
+        #heights and cell mipmap of a block; least recently used blocks are dropped from the cache
+        key = (br, bc)
+        if key in self.cache.keys():
+            self.cache.move_to_end(key)
+            return self.cache[key]
+
+        bs = self.block_size
+        arr_h = self.read_window(br*bs, bc*bs, bs+1, bs+1)
+        levels = min_max_mipmap(*cell_min_max(arr_h))
+
+        self.cache[key] = (arr_h, levels)
+        if len(self.cache) > self.cache_blocks:
+            self.cache.popitem(last=False)
+
+        return self.cache[key]
+
+    def node_range(self, lvl, i, j):
+
+        #height range of the node at lvl; a node of lvl covers 2**lvl x 2**lvl cells
+        if lvl >= self.block_lvl:
+            lvl_min, lvl_max = self.block_levels[lvl - self.block_lvl]
+            if (i >= lvl_min.shape[0]) or (j >= lvl_min.shape[1]):
+                return np.inf, -np.inf
+            return lvl_min[i, j], lvl_max[i, j]
+
+        scale = 2**(self.block_lvl - lvl)
+        br, bc = i // scale, j // scale
+        if (br >= self.nr_block_rows) or (bc >= self.nr_block_cols):
+            return np.inf, -np.inf
+
+        _, levels = self.block(br, bc)
+        lvl_min, lvl_max = levels[lvl]
+        return lvl_min[i - br*scale, j - bc*scale], lvl_max[i - br*scale, j - bc*scale]
+
+    def cell_heights(self, i, j):
+        bs = self.block_size
+        arr_h, _ = self.block(i // bs, j // bs)
+        bi, bj = i % bs, j % bs
+        return arr_h[bi, bj], arr_h[bi, bj+1], arr_h[bi+1, bj], arr_h[bi+1, bj+1]
+
+    def ray2cells(self, ray):
+
+        #rays are transformed to cell coordinates (col, row, z); the first cell has its upper left
+        #corner at the center of the first pixel. The transformation is affine; hence, t is kept.
+        o = ray[:3] + self.origin
+        d = ray[3:6]
+
+        o_cell = np.array([(o[0] - self.gt[0]) / self.gt[1] - 0.5, (o[1] - self.gt[3]) / self.gt[5] - 0.5, o[2]])
+        d_cell = np.array([d[0] / self.gt[1], d[1] / self.gt[5], d[2]])
+        return o_cell, d_cell
+
+    def cast_ray(self, ray, t_max=np.inf):
+
+        o, d = self.ray2cells(np.asarray(ray, dtype=np.float64))
+
+        t_in, t_out = slab(o[0], d[0], 0, self.nr_cell_cols, 0, t_max)
+        t_in, t_out = slab(o[1], d[1], 0, self.nr_cell_rows, t_in, t_out)
+        t_in, t_out = slab(o[2], d[2], self.min_h, self.max_h, t_in, t_out)
+        if t_in > t_out:
+            return np.inf
+
+        #depth first traversal of the min/max mipmap; children are visited front to back along the
+        #ray; hence, the first hit is the closest one
+        stack = [(self.top_lvl, 0, 0, t_in, t_out)]
+        while stack:
+            lvl, i, j, t_in, t_out = stack.pop()
+
+            node_min, node_max = self.node_range(lvl, i, j)
+            z_in, z_out = o[2] + t_in * d[2], o[2] + t_out * d[2]
+            if (min(z_in, z_out) > node_max) or (max(z_in, z_out) < node_min):
+                continue
+
+            if lvl == 0:
+                cell_o = o - np.array([j, i, 0])
+                t_hit = bilinear_hit(cell_o, d, self.cell_heights(i, j), t_in, t_out)
+                if t_hit is not None:
+                    return t_hit
+                continue
+
+            children = []
+            size = 2**(lvl-1)
+            for (ci, cj) in [(2*i, 2*j), (2*i, 2*j+1), (2*i+1, 2*j), (2*i+1, 2*j+1)]:
+                c_in, c_out = slab(o[0], d[0], cj*size, (cj+1)*size, t_in, t_out)
+                c_in, c_out = slab(o[1], d[1], ci*size, (ci+1)*size, c_in, c_out)
+                if c_in <= c_out:
+                    children.append((lvl-1, ci, cj, c_in, c_out))
+
+            stack.extend(sorted(children, key=lambda c: c[3], reverse=True))
+
+        return np.inf
+
+    def cast_rays(self, rays, t_max=np.inf):
+
+        #rays as (n, 6) array of origin and direction as for open3d's RaycastingScene; missed rays get
+        #an infinite t_hit
+        rays = np.asarray(rays, dtype=np.float64).reshape(-1, 6)
+        t_hit = np.full(len(rays), np.inf)
+
+        #the blocks read for one ray stay in the cache for the following ones; rays of one image
+        #mostly cross the same blocks
+        for rx, ray in enumerate(rays):
+            t_hit[rx] = self.cast_ray(ray, t_max=t_max)
+
+        return t_hit
+
+    def heights(self, xy):
+
+        #bilinear interpolation of the DTM at xy; points outside of the raster or in cells touching
+        #nodata get nan
+        xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+        u = (xy[:, 0] + self.origin[0] - self.gt[0]) / self.gt[1] - 0.5
+        v = (xy[:, 1] + self.origin[1] - self.gt[3]) / self.gt[5] - 0.5
+
+        cj = np.clip(np.floor(u), 0, self.nr_cell_cols - 1).astype(np.int64)
+        ci = np.clip(np.floor(v), 0, self.nr_cell_rows - 1).astype(np.int64)
+        a = u - cj
+        b = v - ci
+
+        hgt = np.full(len(xy), np.nan)
+        valid = (u >= 0) & (u <= self.nr_cell_cols) & (v >= 0) & (v <= self.nr_cell_rows)
+
+        bs = self.block_size
+        block_ids = (ci // bs) * self.nr_block_cols + (cj // bs)
+        for bid in np.unique(block_ids[valid]):
+            in_block = valid & (block_ids == bid)
+            arr_h, _ = self.block(bid // self.nr_block_cols, bid % self.nr_block_cols)
+
+            bi, bj = ci[in_block] % bs, cj[in_block] % bs
+            ba, bb = a[in_block], b[in_block]
+            hgt[in_block] = arr_h[bi, bj] * (1 - ba) * (1 - bb) + arr_h[bi, bj+1] * ba * (1 - bb) + \
+                            arr_h[bi+1, bj] * (1 - ba) * bb + arr_h[bi+1, bj+1] * ba * bb
+
+        return hgt - self.origin[2]
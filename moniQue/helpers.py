@@ -1,5 +1,259 @@
+import os
+import glob
+from heapq import heappush, heappop
 import pygfx as gfx
 import numpy as np
+import open3d as o3d
+from osgeo import gdal
+
+from .tileformat import TILE_BIN_MAGIC, TILE_BIN_VERSION, TILE_BIN_QUANTIZED, TILE_BIN_HEADER, zigzag_decode
+
+def read_tile_bin(path):
+    
+    #the file is memory mapped and all arrays are views into it; hence, nothing is copied 
+    #until the data is uploaded to the gpu
+    buf = np.memmap(path, dtype=np.uint8, mode="r")
+    
+    header = buf[:TILE_BIN_HEADER.itemsize].view(TILE_BIN_HEADER)[0]
+    if header["magic"] != TILE_BIN_MAGIC or header["version"] != TILE_BIN_VERSION:
+        raise ValueError("%s is not a valid tile." % (path))
+    
+    nr_verts = int(header["nr_vertices"])
+    nr_tris = int(header["nr_triangles"])
+    
+    verts_start = TILE_BIN_HEADER.itemsize
+    
+    if header["flags"] & TILE_BIN_QUANTIZED:
+        return (header, ) + decode_tile_bin(header, buf, verts_start, nr_verts)
+    
+    uv_start = verts_start + nr_verts * 3 * 4
+    tris_start = uv_start + nr_verts * 2 * 4
+    tris_end = tris_start + nr_tris * 3 * 4
+    
+    verts = buf[verts_start:uv_start].view(np.float32).reshape(-1, 3)
+    uv = buf[uv_start:tris_start].view(np.float32).reshape(-1, 2)
+    tris = buf[tris_start:tris_end].view(np.uint32).reshape(-1, 3)
+    
+    return header, verts, uv, tris
+
+def decode_tile_bin(header, buf, verts_start, nr_verts):
+    
+    verts_end = verts_start + nr_verts * 3 * 2
+    tris_start = verts_end + (verts_end - verts_start) % 4
+    tris_end = tris_start + int(header["idx_nbytes"])
+    
+    verts_q = buf[verts_start:verts_end].view(np.uint16).reshape(-1, 3)
+    
+    #row/col are transformed with the geotransform of the tile; the offset to the origin is
+    #applied in float64 before the vertices are converted to float32
+    gt = header["tile_gt"]
+    origin = header["origin"]
+    z_range = header["z_range"]
+    
+    rows = verts_q[:, 0].astype(np.float64)
+    cols = verts_q[:, 1].astype(np.float64)
+    
+    verts = np.empty((nr_verts, 3), dtype=np.float32)
+    verts[:, 0] = gt[1] * cols + gt[2] * rows + (gt[0] - origin[0])
+    verts[:, 1] = gt[4] * cols + gt[5] * rows + (gt[3] - origin[1])
+    verts[:, 2] = verts_q[:, 2] * ((z_range[1] - z_range[0]) / 65535.) + (z_range[0] - origin[2])
+    
+    #uv coordinates refer to the extent of the tile the orthophoto is cut to
+    extent = header["extent"]
+    uv = np.empty((nr_verts, 2), dtype=np.float32)
+    uv[:, 0] = (verts[:, 0] - (extent[0] - origin[0])) / (extent[2] - extent[0])
+    uv[:, 1] = (verts[:, 1] - (extent[1] - origin[1])) / (extent[3] - extent[1])
+    
+    tris = zigzag_decode(buf[tris_start:tris_end])
+    
+    return verts, uv, tris
+
+def read_tile_data(tile, tile_dir, tile_fmt, op_dir, min_xyz, texture=True):
+    
+    #decodes the geometry and the texture of a tile to plain arrays; nothing in here touches the gpu 
+    #or Qt; hence, it can be run by worker threads. gdal and numpy release the GIL while reading.
+    geom_path = os.path.normpath(os.path.join(tile_dir, "%s.%s" % (tile["tid"], tile_fmt)))
+    if not os.path.exists(geom_path):
+        return None
+    
+    if tile_fmt == "mqt":
+        #vertices are relative to the origin of the tile; the offset to the scene is applied 
+        #to the mesh itself; hence, the memory mapped arrays can be used without copying them
+        tile_header, verts, uv, faces = read_tile_bin(geom_path)
+        tile_offset = tile_header["origin"] - min_xyz
+    else:
+        tile_mesh = o3d.io.read_triangle_mesh(geom_path)
+        verts = np.asarray(tile_mesh.vertices).astype(np.float32)
+        
+        #orthophotos cut by MeshGrid.cut_orthophoto cover the extent of the tile grid; older 
+        #projects only provide the extent of the vertices
+        if "extent" in tile.keys():
+            uv_min, uv_max = tile["extent"][:2], tile["extent"][2:]
+        else:
+            uv_min, uv_max = tile["min_xyz"][:2], tile["max_xyz"][:2]
+        
+        u = (verts[:, 0] - uv_min[0])/(uv_max[0] - uv_min[0])
+        v = (verts[:, 1] - uv_min[1])/(uv_max[1] - uv_min[1])
+        uv = np.hstack((u.reshape(-1, 1), v.reshape(-1, 1))).astype(np.float32)
+        
+        verts -= min_xyz
+        faces = np.asarray(tile_mesh.triangles).astype(np.uint32)
+        tile_offset = np.zeros(3)
+    
+    op_paths = glob.glob(os.path.normpath(os.path.join(op_dir, "%s.*" % (tile["tid"]))))
+    
+    #all three bands are read at once; the flip to the texture orientation is done within the
+    #single copy to a contiguous array
+    if texture and (len(op_paths) == 1):
+        img_ds = gdal.Open(op_paths[0])
+        img_arr = img_ds.ReadAsArray(band_list=[1, 2, 3])
+        img_arr = np.ascontiguousarray(np.transpose(img_arr, (1, 2, 0))[::-1, :, :], dtype=np.uint8)
+    else:
+        img_arr = None
+    
+    #the raycasting scene has no transformation per mesh; hence, it gets the vertices relative to min_xyz
+    scene_verts = (verts + tile_offset).astype(np.float32)
+    
+    return {"tid_int":int(tile["tid_int"]), "verts":verts, "uv":uv, "faces":faces, "offset":tile_offset, 
+            "scene_verts":scene_verts, "texture":img_arr}
+
+class TileIndex():
+    
+    #results of the node tests; tiles below a node which is completely inside are taken without 
+    #testing its children
+    OUTSIDE = 0
+    INTERSECT = 1
+    INSIDE = 2
+    
+    def __init__(self, tiles_data):
+        
+        nodes = tiles_data["index"]["nodes"]
+        self.order = np.array(tiles_data["index"]["order"], dtype=np.int64)
+        self.min_xyz = np.array([n["min_xyz"] for n in nodes], dtype=np.float64)
+        self.max_xyz = np.array([n["max_xyz"] for n in nodes], dtype=np.float64)
+        self.first = [n["first"] for n in nodes]
+        self.count = [n["count"] for n in nodes]
+        self.children = [n["children"] for n in nodes]
+    
+    def query(self, test_node):
+        
+        tids = []
+        stack = [0]
+        while stack:
+            nix = stack.pop()
+            result = test_node(nix)
+            
+            if result == self.OUTSIDE:
+                continue
+            elif (result == self.INSIDE) or (len(self.children[nix]) == 0):
+                tids.append(self.order[self.first[nix]:self.first[nix]+self.count[nix]])
+            else:
+                stack.extend(self.children[nix])
+        
+        if len(tids) == 0:
+            return np.empty(0, dtype=np.int64)
+        return np.sort(np.concatenate(tids))
+    
+    def query_box(self, min_xyz, max_xyz):
+        
+        #boxes with two coordinates are only tested in xy
+        qmin = np.asarray(min_xyz, dtype=np.float64)
+        qmax = np.asarray(max_xyz, dtype=np.float64)
+        nd = len(qmin)
+        
+        def test_node(nix):
+            nmin = self.min_xyz[nix, :nd]
+            nmax = self.max_xyz[nix, :nd]
+            if np.any(nmax < qmin) or np.any(nmin > qmax):
+                return self.OUTSIDE
+            if np.all(nmin >= qmin) and np.all(nmax <= qmax):
+                return self.INSIDE
+            return self.INTERSECT
+        
+        return self.query(test_node)
+    
+    def query_point(self, x, y):
+        return self.query_box([x, y], [x, y])
+    
+    def frustum_test(self, normals, offsets):
+        
+        #normals point away from the frustum area; a point p is outside of a plane if n*p > offset. 
+        #For each plane only the box corner closest to (or farthest from) the plane is tested.
+        normals = np.asarray(normals, dtype=np.float64)
+        offsets = np.asarray(offsets, dtype=np.float64)
+        pos_normals = normals > 0
+        
+        def test_node(nix):
+            near_pnts = np.where(pos_normals, self.min_xyz[nix], self.max_xyz[nix])
+            if np.any(np.sum(normals * near_pnts, axis=1) > offsets):
+                return self.OUTSIDE
+            far_pnts = np.where(pos_normals, self.max_xyz[nix], self.min_xyz[nix])
+            if np.all(np.sum(normals * far_pnts, axis=1) <= offsets):
+                return self.INSIDE
+            return self.INTERSECT
+        
+        return test_node
+    
+    def query_frustum(self, normals, offsets):
+        return self.query(self.frustum_test(normals, offsets))
+
+def horizon_occlusion(cam_pos, tile_min, tile_max, tile_full, nr_bins=1024):
+    
+    #horizon buffer of elevation angles over azimuth bins around the camera; tiles are processed from front 
+    #to back. A tile is occluded if the highest elevation it can reach is below the horizon in all bins it 
+    #touches. Otherwise, it raises the horizon in the bins it covers completely to the lowest elevation its 
+    #surface can have; the terrain is continuous over the tile; hence, every ray below this elevation within 
+    #its azimuth span hits the tile. This only holds for tiles behind it; hence, the horizon is raised as soon
+    #as the closest remaining tile is farther away than the whole tile. Tiles with gaps (tile_full is False)
+    #might let rays pass; hence, they are tested but never raise the horizon.
+    nr_tiles = len(tile_min)
+    occluded = np.zeros(nr_tiles, dtype=bool)
+    if nr_tiles == 0:
+        return occluded
+    
+    corners_x = np.stack([tile_min[:, 0], tile_max[:, 0], tile_max[:, 0], tile_min[:, 0]], axis=1) - cam_pos[0]
+    corners_y = np.stack([tile_min[:, 1], tile_min[:, 1], tile_max[:, 1], tile_max[:, 1]], axis=1) - cam_pos[1]
+    
+    #horizontal distance to the closest and the farthest point of the footprint of each tile
+    near_x = np.clip(cam_pos[0], tile_min[:, 0], tile_max[:, 0]) - cam_pos[0]
+    near_y = np.clip(cam_pos[1], tile_min[:, 1], tile_max[:, 1]) - cam_pos[1]
+    near = np.hypot(near_x, near_y)
+    far = np.max(np.hypot(corners_x, corners_y), axis=1)
+    
+    #azimuth span of the footprint relative to the azimuth of its center; footprints are convex and do not 
+    #contain the camera; hence, the span is below pi
+    center_az = np.arctan2(np.mean(corners_y, axis=1), np.mean(corners_x, axis=1))
+    delta_az = (np.arctan2(corners_y, corners_x) - center_az[:, None] + np.pi) % (2*np.pi) - np.pi
+    az_bins = (np.stack([center_az + np.min(delta_az, axis=1), center_az + np.max(delta_az, axis=1)], axis=1) + np.pi) / (2*np.pi) * nr_bins
+    
+    dz_max = tile_max[:, 2] - cam_pos[2]
+    dz_min = tile_min[:, 2] - cam_pos[2]
+    max_elev = np.arctan2(dz_max, np.where(dz_max >= 0, near, far))
+    min_elev = np.arctan2(dz_min, np.where(dz_min >= 0, far, near))
+    
+    horizon = np.full(nr_bins, -np.pi/2)
+    occluders = []
+    
+    for tx in np.argsort(near):
+        
+        while occluders and (occluders[0][0] <= near[tx]):
+            _, ox = heappop(occluders)
+            covered = np.arange(int(np.ceil(az_bins[ox, 0])), int(np.floor(az_bins[ox, 1]))) % nr_bins
+            horizon[covered] = np.maximum(horizon[covered], min_elev[ox])
+        
+        #tiles below the camera are never occluded and do not occlude anything
+        if near[tx] == 0:
+            continue
+        
+        touched = np.arange(int(np.floor(az_bins[tx, 0])), int(np.floor(az_bins[tx, 1])) + 1) % nr_bins
+        if np.all(horizon[touched] > max_elev[tx]):
+            occluded[tx] = True
+            continue
+        
+        if tile_full[tx]:
+            heappush(occluders, (far[tx], tx))
+    
+    return occluded
 
 def create_point_3d(pos, gid, clr):
 
@@ -0,0 +1,150 @@
+import pygfx as gfx
+import numpy as np
+
+from concurrent.futures import ThreadPoolExecutor
+
+def tile_nbytes(tile_data):
+    nbytes = tile_data["verts"].nbytes + tile_data["uv"].nbytes + tile_data["faces"].nbytes
+
+    #mipmaps add a third to the size of the texture
+    if tile_data["texture"] is not None:
+        nbytes += tile_data["texture"].nbytes * 4 // 3
+    return nbytes
+
+class TileResidency():
+
+    def __init__(self, tiles_data, read_func, tile_dirs, min_xyz, budget_mb=1024, workers=4, on_error=None):
+
+        #tile_dirs holds the directory of each level of detail; read_func(tile, tile_dir=...) decodes one
+        #tile of one level; on_error(tid_int, exception) is called for tiles which could not be decoded
+        self.tiles = {int(tile["tid_int"]):tile for tile in tiles_data["tiles"]}
+        self.read_func = read_func
+        self.tile_dirs = tile_dirs
+        self.default_lvl = list(tile_dirs.keys())[0]
+        self.min_xyz = min_xyz
+        self.budget = budget_mb * 1024**2
+        self.on_error = on_error
+
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+
+        self.resident = {}  #tid_int:(olvl, nbytes)
+        self.pending = {}   #tid_int:(olvl, future)
+        self.last_visible = {}
+        self.frame = 0
+        self.nbytes = 0
+
+        #placeholders are not pickable; otherwise, picking would return points on the flat quad instead of 
+        #the terrain, e.g. for tiles which could not be decoded
+        self.placeholder_material = gfx.MeshBasicMaterial(color=(0.6, 0.6, 0.6, 1), side="FRONT", pick_write=False)
+
+        #one gfx.Mesh per tile indexed by tid_int; the meshes stay in the scene all the time and only 
+        #their geometry and material are swapped between the placeholder and the loaded tile. Their 
+        #visibility is controlled by the groups of the terrain.
+        self.meshes = [gfx.Mesh(self.placeholder_geometry(tid_int), self.placeholder_material) 
+                       for tid_int in sorted(self.tiles.keys())]
+
+    def placeholder_geometry(self, tid_int):
+
+        #flat quad over the extent of the tile at its mean height; the mesh has no offset while showing
+        #the placeholder; hence, the quad is given relative to min_xyz of the scene
+        tile = self.tiles[tid_int]
+        if "extent" in tile.keys():
+            min_x, min_y, max_x, max_y = tile["extent"]
+        else:
+            min_x, min_y = tile["min_xyz"][:2]
+            max_x, max_y = tile["max_xyz"][:2]
+        mean_z = (tile["min_xyz"][2] + tile["max_xyz"][2]) / 2.
+
+        verts = np.array([[min_x, min_y, mean_z],
+                          [max_x, min_y, mean_z],
+                          [max_x, max_y, mean_z],
+                          [min_x, max_y, mean_z]]) - self.min_xyz
+
+        return gfx.geometries.Geometry(indices=np.array([[0, 1, 2], [0, 2, 3]], dtype=np.uint32),
+                                       positions=verts.astype(np.float32),
+                                       texcoords=np.zeros((4, 2), dtype=np.float32),
+                                       tid=[tid_int])
+
+    def set_placeholder(self, tid_int):
+        mesh = self.meshes[tid_int]
+        mesh.geometry = self.placeholder_geometry(tid_int)
+        mesh.material = self.placeholder_material
+        mesh.local.position = np.zeros(3)
+
+    def set_tile(self, tile_data):
+
+        mesh_geom = gfx.geometries.Geometry(indices=tile_data["faces"],
+                                            positions=tile_data["verts"],
+                                            texcoords=tile_data["uv"],
+                                            tid=[tile_data["tid_int"]])
+
+        if tile_data["texture"] is not None:
+            tex = gfx.Texture(tile_data["texture"], dim=2, generate_mipmaps=True)
+            mesh_material = gfx.MeshBasicMaterial(map=tex, side="FRONT", pick_write=True)
+        else:
+            mesh_material = gfx.MeshNormalMaterial(side="FRONT", pick_write=True)
+
+        mesh = self.meshes[tile_data["tid_int"]]
+        mesh.geometry = mesh_geom
+        mesh.material = mesh_material
+        mesh.local.position = tile_data["offset"]
+
+    def update(self, visible_tids, visible_lvls=None):
+
+        #called once per frame with the tiles passing the culling and the level of detail of each; returns 
+        #True as long as tiles are loading; hence, the caller has to request another frame to show them once 
+        #they are done. While another level of a tile is loading, its current level is kept.
+        if visible_lvls is None:
+            visible_lvls = [self.default_lvl] * len(visible_tids)
+
+        self.frame += 1
+        for tid_int, olvl in zip(visible_tids, visible_lvls):
+            self.last_visible[tid_int] = self.frame
+            if (self.resident.get(tid_int, (None, 0))[0] != olvl) and (tid_int not in self.pending.keys()):
+                future = self.pool.submit(self.read_func, self.tiles[tid_int], tile_dir=self.tile_dirs[olvl])
+                self.pending[tid_int] = (olvl, future)
+
+        #finished tiles are uploaded by the main thread only
+        for tid_int in [tid for tid, (_, future) in self.pending.items() if future.done()]:
+            olvl, future = self.pending.pop(tid_int)
+            
+            #tiles which can not be decoded (e.g. truncated files or files of another version) are kept as 
+            #placeholder; otherwise, they would be requested and fail again in every frame
+            try:
+                tile_data = future.result()
+            except Exception as e:
+                tile_data = None
+                if self.on_error is not None:
+                    self.on_error(tid_int, e)
+
+            self.nbytes -= self.resident.get(tid_int, (None, 0))[1]
+            if tile_data is None:
+                self.set_placeholder(tid_int)
+                self.resident[tid_int] = (olvl, 0)
+                continue
+
+            self.set_tile(tile_data)
+            self.resident[tid_int] = (olvl, tile_nbytes(tile_data))
+            self.nbytes += self.resident[tid_int][1]
+
+        self.evict()
+        return len(self.pending) > 0
+
+    def evict(self):
+
+        #least recently visible tiles are dropped first; tiles visible in the current frame are kept
+        #even if the budget is exceeded
+        if self.nbytes <= self.budget:
+            return
+
+        candidates = sorted([tid for tid in self.resident.keys() if self.last_visible.get(tid, 0) < self.frame],
+                            key=lambda tid: self.last_visible.get(tid, 0))
+
+        for tid_int in candidates:
+            if self.nbytes <= self.budget:
+                break
+            self.nbytes -= self.resident.pop(tid_int)[1]
+            self.set_placeholder(tid_int)
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
@@ -3,9 +3,22 @@ import numpy as np
 from osgeo import gdal, osr
 from pymartini import Martini
 import os
-from json import dump
+import sys
+import threading
+import multiprocessing
+from json import dump, load
+import hashlib
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from collections import deque
+
+from .heightfield import DtmRaycaster, BLOCKS_FILE
+from .tileformat import TILE_BIN_MAGIC, TILE_BIN_VERSION, TILE_BIN_QUANTIZED, TILE_BIN_HEADER, zigzag_encode, quantize_heights, build_tile_index
 
 gdal.UseExceptions()
+
+class MeshGridCanceled(Exception):
+    pass
  
 def load_geoimg(img_path, nr_bands=3, band_dtype=np.uint8):
 
@@ -28,6 +41,34 @@ def load_geoimg(img_path, nr_bands=3, band_dtype=np.uint8):
     
     return band_arr.squeeze(), ds_gt, ds_geo, ds_h, ds_w, ds_nd
 
+def read_tile_window(ds, min_r, max_r, min_c, max_c, tile_size, nodata=None):
+    
+    #windows at the right and lower border of the raster extend beyond the raster; hence, we
+    #only read the part inside the raster and pad the rest afterwards with -1
+    win_h = min(max_r, ds.RasterYSize) - min_r
+    win_w = min(max_c, ds.RasterXSize) - min_c
+    
+    tile_arr = ds.GetRasterBand(1).ReadAsArray(int(min_c), int(min_r), int(win_w), int(win_h)).astype(np.float32)
+    
+    if nodata is not None:
+        tile_arr[tile_arr == nodata] = -1
+    
+    if win_h != tile_size:
+        tile_arr = np.pad(tile_arr, pad_width=((0, tile_size-win_h), (0, 0)), mode="constant", constant_values=-1)
+    
+    if win_w != tile_size:
+        tile_arr = np.pad(tile_arr, pad_width=((0, 0), (0, tile_size-win_w)), mode="constant", constant_values=-1)
+    
+    assert np.shape(tile_arr) == (tile_size, tile_size)
+    
+    return tile_arr
+
+def window_hash(tile_arr):
+    #windows without any valid pixel do not produce a tile; hence, they do not need a hash
+    if np.all(tile_arr == -1):
+        return None
+    return hashlib.sha1(tile_arr.tobytes()).hexdigest()
+
 def geo2px(coords, gt):
     feat_vx_col = np.floor((coords[:, 0] - gt[0]) / gt[1]).astype(int)
     feat_vx_row = np.floor((coords[:, 1] - gt[3]) / gt[5]).astype(int)
@@ -67,20 +108,178 @@ def mesh_from_array(arr_h, arr_w):
     
     return faces.astype(np.uint32)
 
+def write_tile_bin(opath, tile, tid, max_error, quantize=False, z_range=None):
+    
+    verts_geo = tile.vertices_geo()
+    tris = tile.triangles
+    
+    min_xyz = np.min(verts_geo, axis=0)
+    max_xyz = np.max(verts_geo, axis=0)
+    
+    #heights are quantized within z_range; tiles sharing seams must be written with the same range
+    if z_range is None:
+        z_range = [min_xyz[2], max_xyz[2]]
+    
+    header = np.zeros(1, dtype=TILE_BIN_HEADER)
+    header["magic"] = TILE_BIN_MAGIC
+    header["version"] = TILE_BIN_VERSION
+    header["nr_vertices"] = len(verts_geo)
+    header["nr_triangles"] = len(tris)
+    header["tid"] = [int(x) for x in tid.split("_")]
+    header["max_error"] = max_error
+    header["origin"] = min_xyz
+    header["min_xyz"] = min_xyz
+    header["max_xyz"] = max_xyz
+    header["tile_gt"] = tile.tile_gt
+    header["extent"] = tile.extent_geo()
+    header["z_range"] = z_range
+    
+    with open(opath, "wb") as f:
+        
+        if quantize:
+            #row and col are relative to the tile and fit into uint16 for tile sizes up to 65536;
+            #uv coordinates are derived from the decoded vertices and are not stored 
+            verts_q = np.empty((len(verts_geo), 3), dtype=np.uint16)
+            verts_q[:, :2] = tile.vertices
+            verts_q[:, 2] = quantize_heights(verts_geo[:, 2], z_range[0], z_range[1])
+            
+            #with the lower bound of z_range as origin, a quantized height decodes to the same float32 
+            #value in every tile; i.e. vertices on the seams match exactly
+            header["origin"] = [min_xyz[0], min_xyz[1], z_range[0]]
+            
+            tris_zz = zigzag_encode(tris)
+            
+            header["flags"] = TILE_BIN_QUANTIZED
+            header["idx_nbytes"] = len(tris_zz)
+            
+            f.write(header.tobytes())
+            f.write(verts_q.tobytes())
+            f.write(bytes(verts_q.nbytes % 4))
+            f.write(tris_zz.tobytes())
+        else:
+            #float32 is precise enough for coordinates relative to the tile; hence, the vertices are stored 
+            #relative to the lower left corner of the tile
+            verts_local = (verts_geo - min_xyz).astype(np.float32)
+            
+            #texture coordinates of the orthophoto covering the extent of the tile
+            uv = tile.uv(verts_geo)
+            
+            header["idx_nbytes"] = len(tris) * 3 * 4
+            
+            f.write(header.tobytes())
+            f.write(np.ascontiguousarray(verts_local).tobytes())
+            f.write(np.ascontiguousarray(uv, dtype=np.float32).tobytes())
+            f.write(np.ascontiguousarray(tris, dtype=np.uint32).tobytes())
+
+def acmr(triangles, cache_size=32):
+    
+    #average cache miss ratio; i.e. vertices transformed per triangle for a fifo post-transform cache
+    cache = deque()
+    in_cache = set()
+    nr_miss = 0
+    for vx in np.asarray(triangles).ravel().tolist():
+        if vx not in in_cache:
+            nr_miss += 1
+            cache.append(vx)
+            in_cache.add(vx)
+            if len(cache) > cache_size:
+                in_cache.discard(cache.popleft())
+    
+    return nr_miss / max(len(triangles), 1)
+
+def tipsify(triangles, nr_vertices, cache_size=32):
+    
+    #triangle order for the post-transform vertex cache; Sander et al. (2007): Fast triangle reordering 
+    #for vertex locality and reduced overdraw. Triangles are emitted as fans around the current vertex; 
+    #the next one is the vertex of the fan which will still be in the cache or the last one from the dead-end stack
+    tris = np.asarray(triangles, dtype=np.int64)
+    nr_tris = len(tris)
+    
+    #triangles adjacent to each vertex
+    vt_cnt = np.bincount(tris.ravel(), minlength=nr_vertices)
+    vt_start = np.concatenate(([0], np.cumsum(vt_cnt))).tolist()
+    vt_adj = (np.argsort(tris.ravel(), kind="stable") // 3).tolist()
+    
+    tris_list = tris.tolist()
+    live = vt_cnt.tolist()
+    stamp = [0] * nr_vertices
+    is_emitted = [False] * nr_tris
+    
+    out_tix = []
+    dead_end = []
+    curr_time = cache_size + 1
+    cursor = 0
+    
+    fan_vx = 0 if nr_tris > 0 else -1
+    while fan_vx >= 0:
+        
+        cand_vix = []
+        for tx in vt_adj[vt_start[fan_vx]:vt_start[fan_vx+1]]:
+            if not is_emitted[tx]:
+                is_emitted[tx] = True
+                out_tix.append(tx)
+                for vx in tris_list[tx]:
+                    dead_end.append(vx)
+                    cand_vix.append(vx)
+                    live[vx] -= 1
+                    if curr_time - stamp[vx] > cache_size:
+                        stamp[vx] = curr_time
+                        curr_time += 1
+        
+        fan_vx = -1
+        best_prio = -1
+        for vx in cand_vix:
+            if live[vx] > 0:
+                prio = 0
+                if curr_time - stamp[vx] + 2 * live[vx] <= cache_size:
+                    prio = curr_time - stamp[vx]
+                if prio > best_prio:
+                    best_prio = prio
+                    fan_vx = vx
+        
+        if fan_vx == -1:
+            while len(dead_end) > 0:
+                vx = dead_end.pop()
+                if live[vx] > 0:
+                    fan_vx = vx
+                    break
+        
+        if fan_vx == -1:
+            while cursor < nr_vertices and live[cursor] == 0:
+                cursor += 1
+            if cursor < nr_vertices:
+                fan_vx = cursor
+    
+    return np.array(out_tix, dtype=np.int64)
+
 class MeshTile:
-    def __init__(self, vertices=None, triangles=None, tile_arr=None, tile_gt=None, tile_size=None, bounds_local=None, bounds_geo=None):
+    
+    #thousands of tiles are kept in memory; hence, only arrays scaling with the number of vertices and triangles 
+    #are stored. The raster of the tile is only used to sample the heights of the vertices and not kept.
+    __slots__ = ["vertices", "triangles", "heights", "tile_size", "bbox_px", "bbox_geo", "tile_gt", "src_hash", "max_error", 
+                 "nr_vertices", "nr_triangles", 
+                 "l_vix", "r_vix", "t_vix", "b_vix", "l_tix", "r_tix", "t_tix", "b_tix"]
+    
+    def __init__(self, vertices=None, triangles=None, heights=None, tile_arr=None, tile_gt=None, tile_size=None, bounds_local=None, bounds_geo=None, src_hash=None, max_error=None):
         if vertices is None:
             raise ValueError("Vertices must be provided.")
         if triangles is None:
             raise ValueError("Triangles must be provided.")
-        
-        self.vertices = vertices
-        self.triangles = triangles
+        if heights is None:
+            if tile_arr is None:
+                raise ValueError("Heights or tile_arr must be provided.")
+            heights = tile_arr[vertices[:, 0], vertices[:, 1]]
+        
+        #row/col are within the tile; hence, uint16 is sufficient
+        self.vertices = np.ascontiguousarray(vertices, dtype=np.uint16)
+        self.triangles = np.ascontiguousarray(triangles, dtype=np.uint32)
+        self.heights = np.ascontiguousarray(heights, dtype=np.float32)
         self.tile_size = tile_size
         self.bbox_px = bounds_local
         self.bbox_geo = bounds_geo
-        self.tile_arr = tile_arr
         self.tile_gt = tile_gt
+        self.src_hash = src_hash
+        self.max_error = max_error
         
         self.nr_vertices = len(self.vertices)
         self.nr_triangles = len(self.triangles)
@@ -93,112 +292,403 @@ class MeshTile:
     def __repr__(self):
         return "MeshTile(vertices=%i, triangles=%i)" % (self.nr_vertices, self.nr_triangles)
     
-    def extract_boundaries(self):
-        
-        # bdry_coords = self.vertices.reshape(-1, 2)[bdry_vix, :]
-        lix = np.argwhere(self.vertices[:, 1] == 0).ravel()
-        rix = np.argwhere(self.vertices[:, 1] == self.tile_size-1).ravel()
-        tix = np.argwhere(self.vertices[:, 0] == 0).ravel()
-        bix = np.argwhere(self.vertices[:, 0] == self.tile_size-1).ravel()
-        
-        lix_asc = np.argsort(self.vertices[lix, :][:, 0]).ravel()
-        rix_asc = np.argsort(self.vertices[rix, :][:, 0]).ravel()
-        tix_asc = np.argsort(self.vertices[tix, :][:, 1]).ravel()
-        bix_asc = np.argsort(self.vertices[bix, :][:, 1]).ravel()
-        
-        l_vix = lix[lix_asc]
-        r_vix = rix[rix_asc]
-        t_vix = tix[tix_asc]
-        b_vix = bix[bix_asc]
-        
-        assert len(np.unique(l_vix)) == len(l_vix)
-        assert len(np.unique(r_vix)) == len(r_vix)
-        assert len(np.unique(t_vix)) == len(t_vix)
-        assert len(np.unique(b_vix)) == len(b_vix)
-        
-        #LEFT BDRY
-        #get indices of triangles containing border vertices
-        l_tix = np.unique(np.argwhere(np.in1d(self.triangles.ravel(), l_vix)) // 3).ravel()
-        
-        #extract columns and rows of border vertex; for each triangle the coordinates are in one row
-        l_tix_vertex_coord = self.vertices[self.triangles[l_tix, :].ravel(), :].reshape(-1, 6)
-        
-        #for l_border use the column to indicate which are valid border triangles; Those triangles
-        #must contain two vertices where the column is 0; for top or bottom use [0, 2, 4]
-        l_tix_valid_ix = np.count_nonzero(l_tix_vertex_coord[:, [1, 3, 5]] == 0, axis=1) == 2
-        l_tix = l_tix[l_tix_valid_ix]
-        
-        #sort the valid triangle ids by ascending maximum row of the border vertices; for top or bottom use cols: [1, 3, 5]
-        l_tix_asc = np.argsort(np.max(l_tix_vertex_coord[:, [0, 2, 4]], axis=1)[l_tix_valid_ix])
+    def extent_geo(self):
+        #extent of the full vertex grid of the tile (min_x, min_y, max_x, max_y); it is the same for all 
+        #levels of detail and the orthophoto of the tile is cut to it; hence, uv coordinates refer to it
+        corners = np.array([[0, 0], [self.tile_size-1, self.tile_size-1]])
+        corners_geo = px2geo(corners, self.tile_gt, pixel_shift=False)
+        return np.hstack((np.min(corners_geo, axis=0), np.max(corners_geo, axis=0)))
+    
+    def uv(self, verts_geo):
+        extent = self.extent_geo()
+        return (verts_geo[:, :2] - extent[:2]) / (extent[2:] - extent[:2])
+    
+    def is_full(self):
+        #martini covers the whole tile and only triangles with a nodata vertex are dropped; snapping splits 
+        #triangles without changing the covered area. Hence, the tile is full if its triangles have the area of the tile
+        tri_verts = self.vertices[self.triangles].astype(np.int64)
+        edge_a = tri_verts[:, 1, :] - tri_verts[:, 0, :]
+        edge_b = tri_verts[:, 2, :] - tri_verts[:, 0, :]
+        area2 = np.abs(edge_a[:, 0] * edge_b[:, 1] - edge_a[:, 1] * edge_b[:, 0])
+        return int(np.sum(area2)) == 2 * (self.tile_size-1)**2
+    
+    def vertices_geo(self):
+        #tile_gt already contains the pixel shift towards the center; Hence, we don't add it again
+        return np.hstack((px2geo(self.vertices, self.tile_gt, pixel_shift=False), self.heights.reshape(-1, 1)))
+    
+    def reorder(self, cache_size=32, tri_order=None):
         
-        l_tix = l_tix[l_tix_asc]
+        #triangles are reordered for the vertex cache and the vertices are numbered by their first use; 
+        #hence, consecutive triangles fetch nearby vertices as well. The order of tipsify might be searched 
+        #beforehand; e.g. in the worker pool of MeshGrid.save_tiles
+        if tri_order is None:
+            tri_order = tipsify(self.triangles, self.nr_vertices, cache_size=cache_size)
         
-        self.l_vix = l_vix
-        self.l_tix = l_tix
+        triangles = self.triangles[tri_order, :]
         
-        #RIGHT BDRY
-        #get indices of triangles containing border vertices
-        r_tix = np.unique(np.argwhere(np.in1d(self.triangles.ravel(), r_vix)) // 3).ravel()
+        flat_vix = triangles.ravel()
+        uq_vix, uq_vix_first = np.unique(flat_vix, return_index=True)
+        first_use_vix = uq_vix[np.argsort(uq_vix_first)]
         
-        #extract columns and rows of border vertex; for each triangle the coordinates are in one row
-        r_tix_vertex_coord = self.vertices[self.triangles[r_tix, :].ravel(), :].reshape(-1, 6)
+        remap_vix = np.zeros(self.nr_vertices, dtype=np.int64)
+        remap_vix[first_use_vix] = np.arange(len(first_use_vix))
         
-        #for r_border use the column to indicate which are valid border triangles; Those triangles
-        #must contain two vertices where the column is 0; for top or bottom use [0, 2, 4]
-        r_tix_valid_ix = np.count_nonzero(r_tix_vertex_coord[:, [1, 3, 5]] == self.tile_size-1, axis=1) == 2
-        r_tix = r_tix[r_tix_valid_ix]
+        self.vertices = self.vertices[first_use_vix, :]
+        self.heights = self.heights[first_use_vix]
+        self.triangles = remap_vix[triangles].astype(np.uint32)
         
-        #sort the valid triangle ids by ascending maximum row of the border vertices; for top or bottom use cols: [1, 3, 5]
-        r_tix_asc = np.argsort(np.max(r_tix_vertex_coord[:, [0, 2, 4]], axis=1)[r_tix_valid_ix])
+        self.nr_vertices = len(self.vertices)
+        self.nr_triangles = len(self.triangles)
         
-        r_tix = r_tix[r_tix_asc]
+        self.extract_boundaries()
+    
+    def sides(self):
+        #per side: index of the coordinate which is constant along the side, its value and the index
+        #of the coordinate along the side; boundary vertices and triangles are sorted by the latter
+        return {"l":(1, 0, 0), 
+                "r":(1, self.tile_size-1, 0), 
+                "t":(0, 0, 1), 
+                "b":(0, self.tile_size-1, 1)}
+    
+    def classify_vertices(self, vix):
+        vix_coords = self.vertices[vix, :]
+        return {side:vix[vix_coords[:, cix] == cval] for side, (cix, cval, aix) in self.sides().items()}
+    
+    def classify_triangles(self, tix):
+        #boundary triangles of a side have two vertices on that side; the coordinates of all triangles 
+        #are gathered once and used for all four sides
+        tix_coords = self.vertices[self.triangles[tix, :], :]
+        return {side:tix[np.count_nonzero(tix_coords[:, :, cix] == cval, axis=1) == 2] for side, (cix, cval, aix) in self.sides().items()}
+    
+    def sort_boundaries(self, side_vix, side_tix):
+        for side, (cix, cval, aix) in self.sides().items():
+            
+            #vertices by ascending coordinate along the side
+            vix = side_vix[side]
+            vix = vix[np.argsort(self.vertices[vix, aix])]
+            
+            #triangles by the ascending end of their boundary edge; boundary edges do not overlap; hence, this 
+            #is unique for each triangle. The third vertex is ignored as it is shared by the fans created by snapping
+            tix = side_tix[side]
+            tix_coords = self.vertices[self.triangles[tix, :], :].astype(np.int64)
+            tix_edge_end = np.max(np.where(tix_coords[:, :, cix] == cval, tix_coords[:, :, aix], -1), axis=1)
+            tix = tix[np.argsort(tix_edge_end)]
+            
+            setattr(self, "%s_vix" % (side), vix)
+            setattr(self, "%s_tix" % (side), tix)
+    
+    def extract_boundaries(self):
+        side_vix = self.classify_vertices(np.arange(len(self.vertices)))
+        side_tix = self.classify_triangles(np.arange(len(self.triangles)))
+        self.sort_boundaries(side_vix, side_tix)
+    
+    def update_boundaries(self, new_vix, pop_tix, new_tix):
+        
+        #snapping only pops and adds triangles at the boundaries; hence, the existing boundaries are kept and 
+        #only the new vertices and triangles are classified. Triangles after the popped ones move to the front.
+        is_kept = np.ones(len(self.triangles) - len(new_tix) + len(pop_tix), dtype=bool)
+        is_kept[pop_tix] = False
+        kept_tix = np.cumsum(is_kept) - 1
+        
+        new_side_vix = self.classify_vertices(new_vix)
+        new_side_tix = self.classify_triangles(new_tix)
+        
+        side_vix = {}
+        side_tix = {}
+        for side in self.sides().keys():
+            curr_vix = getattr(self, "%s_vix" % (side))
+            curr_tix = getattr(self, "%s_tix" % (side))
+            curr_tix = kept_tix[curr_tix[is_kept[curr_tix]]]
+            
+            side_vix[side] = np.concatenate((curr_vix, new_side_vix[side])).astype(np.int64)
+            side_tix[side] = np.concatenate((curr_tix, new_side_tix[side])).astype(np.int64)
         
-        self.r_vix = r_vix
-        self.r_tix = r_tix
+        self.sort_boundaries(side_vix, side_tix)
+
+def split_weights(tile_size):
+    #every vertex of the tile except the corners is the midpoint of one diamond; splitting a triangle at it 
+    #adds one triangle. Midpoints in the interior are shared by two triangles, those on the boundary by one.
+    weights = np.full((tile_size, tile_size), 2, dtype=np.int64)
+    weights[[0, -1], :] = 1
+    weights[:, [0, -1]] = 1
+    weights[[0, 0, -1, -1], [0, -1, 0, -1]] = 0
+    return weights.ravel()
+
+def error_for_budget(errors, tile_size, max_triangles):
+    
+    #martini splits a triangle if the error at its midpoint exceeds max_error; as the errors of the children
+    #are propagated to the parents, the number of triangles for max_error is 2 + the weights of all errors > max_error
+    errors = np.asarray(errors).ravel()
+    uq_errors, uq_inv = np.unique(errors, return_inverse=True)
+    uq_weights = np.bincount(uq_inv.ravel(), weights=split_weights(tile_size)).astype(np.int64)
+    
+    #number of triangles for each unique error as max_error; it decreases with increasing error
+    nr_tris = 2 + np.concatenate((np.cumsum(uq_weights[::-1])[::-1][1:], [0]))
+    
+    #binary search for the smallest error which meets the budget
+    lvl_errors = []
+    for budget in max_triangles:
+        ex = min(np.searchsorted(-nr_tris, -budget, side="left"), len(uq_errors)-1)
+        lvl_errors.append(float(uq_errors[ex]))
+    
+    return lvl_errors
 
-        #TOP BDRY
-        #get indices of triangles containing border vertices
-        t_tix = np.unique(np.argwhere(np.in1d(self.triangles.ravel(), t_vix)) // 3).ravel()
+class ErrorCache:
+    
+    def __init__(self, path, nr_rows=None, nr_cols=None, tile_size=None):
         
-        #extract columns and rows of border vertex; for each triangle the coordinates are in one row
-        t_tix_vertex_coord = self.vertices[self.triangles[t_tix, :].ravel(), :].reshape(-1, 6)
+        #one record per window of the grid; the hash of the window is stored along with its error map; 
+        #hence, a record is only used as long as the window of the dgm did not change
+        self.path = path
         
-        #for t_border use the column to indicate which are valid border triangles; Those triangles
-        #must contain two vertices where the column is 0; for top or bottom use [0, 2, 4]
-        t_tix_valid_ix = np.count_nonzero(t_tix_vertex_coord[:, [0, 2, 4]] == 0, axis=1) == 2
-        t_tix = t_tix[t_tix_valid_ix]
+        #workers open the file created by the main process
+        if nr_rows is None:
+            self.records = np.lib.format.open_memmap(path, mode="r+")
+            return
         
-        #sort the valid triangle ids by ascending maximum row of the border vertices; for top or bottom use cols: [1, 3, 5]
-        t_tix_asc = np.argsort(np.max(t_tix_vertex_coord[:, [1, 3, 5]], axis=1)[t_tix_valid_ix])
+        dtype = np.dtype([("src_hash", "S40"), ("errors", np.float32, (tile_size*tile_size, ))])
         
-        t_tix = t_tix[t_tix_asc]
+        if os.path.exists(path):
+            records = np.lib.format.open_memmap(path, mode="r+")
+            if (records.dtype == dtype) and (records.shape == (nr_rows, nr_cols)):
+                self.records = records
+                return
+            del records
         
-        self.t_vix = t_vix
-        self.t_tix = t_tix
+        self.records = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=(nr_rows, nr_cols))
+    
+    def get(self, rx, cx, src_hash):
+        if src_hash is None:
+            return None
+        if self.records["src_hash"][rx, cx] != src_hash.encode():
+            return None
+        return self.records["errors"][rx, cx]
+    
+    def put(self, rx, cx, src_hash, errors):
+        if src_hash is None:
+            return
+        #the hash is written last; an interrupted write leaves an invalid record
+        self.records["src_hash"][rx, cx] = b""
+        self.records["errors"][rx, cx] = errors
+        self.records["src_hash"][rx, cx] = src_hash.encode()
 
-        #RIGHT BDRY
-        #get indices of triangles containing border vertices
-        b_tix = np.unique(np.argwhere(np.in1d(self.triangles.ravel(), b_vix)) // 3).ravel()
-        
-        #extract columns and rows of border vertex; for each triangle the coordinates are in one row
-        b_tix_vertex_coord = self.vertices[self.triangles[b_tix, :].ravel(), :].reshape(-1, 6)
-        
-        #for b_border use the column to indicate which are valid border triangles; Those triangles
-        #must contain two vertices where the column is 0; for top or bottom use [0, 2, 4]
-        b_tix_valid_ix = np.count_nonzero(b_tix_vertex_coord[:, [0, 2, 4]] == self.tile_size-1, axis=1) == 2
-        b_tix = b_tix[b_tix_valid_ix]
-        
-        #sort the valid triangle ids by ascending maximum row of the border vertices; for top or bottom use cols: [1, 3, 5]
-        b_tix_asc = np.argsort(np.max(b_tix_vertex_coord[:, [1, 3, 5]], axis=1)[b_tix_valid_ix])
-        
-        b_tix = b_tix[b_tix_asc]
+#get_mesh only depends on the error map of a tile; cached error maps are copied to a tile created once 
+#per grid size instead of calculating the error map again with create_tile. The tiles are thread local, 
+#as the workers of the pool might be threads (see worker_pool)
+_error_tiles = threading.local()
+
+def error_tile(martini, errors):
+    if not hasattr(_error_tiles, "tiles"):
+        _error_tiles.tiles = {}
+    
+    if martini.grid_size not in _error_tiles.tiles.keys():
+        _error_tiles.tiles[martini.grid_size] = martini.create_tile(np.zeros((martini.grid_size, martini.grid_size), dtype=np.float32))
+    
+    tile = _error_tiles.tiles[martini.grid_size]
+    np.asarray(tile.errors_view)[:] = errors
+    return tile
+
+def build_tile(ds, martini, window, tile_size, max_errors, max_triangles=None, error_cache=None):
+    
+    rx, cx, min_r, max_r, min_c, max_c = window
+    ds_gt = ds.GetGeoTransform()
+    ds_nd = ds.GetRasterBand(1).GetNoDataValue()
+    
+    bounds_geo = px2geo(np.array([[min_r, min_c], 
+                                  [max_r, max_c]]), gt=ds_gt)
+    
+    min_x_geo = np.min(bounds_geo[:, 0])
+    max_y_geo = np.max(bounds_geo[:, 1])
+    
+    tile_gt = (min_x_geo, ds_gt[1], ds_gt[2], max_y_geo, ds_gt[4], ds_gt[5])
+    tile_bbox = list(bounds_geo.ravel())
+    
+    tile_arr = read_tile_window(ds, min_r, max_r, min_c, max_c, tile_size, nodata=ds_nd)
+    src_hash = window_hash(tile_arr)
+    
+    #the error map is calculated only once per tile; extracting the mesh for each level of detail 
+    #from it with get_mesh is cheap in comparison
+    errors = None
+    if error_cache is not None:
+        errors = error_cache.get(rx, cx, src_hash)
+    
+    if errors is not None:
+        tile = error_tile(martini, errors)
+    else:
+        tile = martini.create_tile(tile_arr)
+        if error_cache is not None:
+            error_cache.put(rx, cx, src_hash, tile.errors_view)
+    
+    #with a triangle budget the error of each level is searched in the error map of the tile
+    if max_triangles is not None:
+        max_errors = error_for_budget(tile.errors_view, tile_size, max_triangles)
+    
+    mesh_tiles = []
+    for max_error in max_errors:
+        vertices, triangles = tile.get_mesh(max_error)
         
-        self.b_vix = b_vix
-        self.b_tix = b_tix
+        #martini returns vertices as col/row; we further use row/col; hence, np.fliplr
+        vertices = np.fliplr(vertices.reshape(-1, 2))
+        triangles = triangles.reshape(-1, 3)
+                        
+        vert_h = tile_arr[vertices[:, 0], vertices[:, 1]]
+        tris_vert_h = vert_h[triangles.ravel()].reshape(-1, 3)
+         
+        valid_tix = np.nonzero(~np.any(tris_vert_h==-1, axis=1))[0]
+        if len(valid_tix) == 0:
+            mesh_tiles.append(None)
+            continue
+        
+        valid_tris = triangles[valid_tix, :]
+        valid_tris_vix, valid_tris_vix_ix, valid_tris_vix_inv = np.unique(valid_tris, return_inverse=True, return_index=True)
+        #inv for creating new ids of triangles
+        # ix for extracting the corresponding vertices
+        new_tris_vix = np.arange(len(valid_tris_vix))
+        
+        triangles = new_tris_vix[valid_tris_vix_inv].reshape(-1, 3)
+        vertices = vertices[valid_tris_vix, :]               
+        
+        mesh_tiles.append(MeshTile(vertices=vertices, 
+                                   triangles=triangles, 
+                                   heights=vert_h[valid_tris_vix],
+                                   tile_size=tile_size,
+                                   tile_gt=tile_gt,
+                                   bounds_local=[min_c, min_r, max_c, max_r],
+                                   bounds_geo=tile_bbox,
+                                   src_hash=src_hash,
+                                   max_error=max_error))
+    
+    return mesh_tiles
+
+#per worker state of the worker pool used by MeshGrid.build; gdal datasets can not be pickled, 
+#hence, every worker opens its own handle to the dgm. The state is thread local as the pool might 
+#consist of threads (see worker_pool)
+_worker = threading.local()
+
+def worker_executable():
+    
+    #spawned workers start sys.executable; within qgis this is the qgis binary (e.g. qgis-bin.exe on 
+    #windows) and not the python interpreter. The interpreter is then searched in the python prefix.
+    exe_name = os.path.splitext(os.path.basename(sys.executable))[0].lower()
+    if exe_name.startswith("python"):
+        return sys.executable
+    
+    for exe_dir in [sys.exec_prefix, os.path.join(sys.exec_prefix, "bin")]:
+        for exe_name in ["python.exe", "python3.exe", "python3", "python"]:
+            exe_path = os.path.join(exe_dir, exe_name)
+            if os.path.isfile(exe_path):
+                return exe_path
+    return None
+
+def worker_pool(workers, initializer, initargs):
+    
+    #worker processes are always spawned with the python interpreter; if it can not be found, the pool falls 
+    #back to threads. Gdal releases the gil while reading; hence, threads still help with reading the windows.
+    exe_path = worker_executable()
+    if exe_path is None:
+        return ThreadPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs)
+    
+    ctx = multiprocessing.get_context("spawn")
+    ctx.set_executable(exe_path)
+    return ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=initializer, initargs=initargs)
+
+def _init_worker(path, tile_size, cache_path=None):
+    _worker.ds = gdal.Open(path)
+    _worker.martini = Martini(tile_size)
+    _worker.error_cache = ErrorCache(cache_path) if cache_path is not None else None
+
+def _build_tile_worker(job, tile_size, max_errors):
+    window, max_triangles = job
+    return build_tile(_worker.ds, _worker.martini, window, tile_size, max_errors, max_triangles=max_triangles, error_cache=_worker.error_cache)
+
+def _tipsify_worker(job):
+    triangles, nr_vertices = job
+    return tipsify(triangles, nr_vertices)
+
+def hash_tile(ds, window, tile_size):
+    rx, cx, min_r, max_r, min_c, max_c = window
+    ds_nd = ds.GetRasterBand(1).GetNoDataValue()
+    return window_hash(read_tile_window(ds, min_r, max_r, min_c, max_c, tile_size, nodata=ds_nd))
+
+def _hash_tile_worker(window, tile_size):
+    return hash_tile(_worker.ds, window, tile_size)
+
+#gdal drivers of the supported texture formats of the orthophoto tiles
+ORTHO_DRIVERS = {"jpg":"JPEG", "png":"PNG"}
+
+def texture_size(extent, op_res, downsample=1, max_size=4096):
+    #textures are a power of two; the size closest to the resolution of the orthophoto is used
+    nr_px = max(extent[2]-extent[0], extent[3]-extent[1]) / (op_res * downsample)
+    size = 2**int(np.round(np.log2(max(nr_px, 1))))
+    return int(min(size, max_size))
+
+def ortho_bands(ds):
+    #the viewer always reads three bands; single band orthophotos are repeated as rgb
+    if ds.RasterCount >= 3:
+        return [1, 2, 3]
+    return [1, 1, 1]
+
+def ortho_bounds(ds):
+    gt = ds.GetGeoTransform()
+    xs = [gt[0], gt[0] + gt[1] * ds.RasterXSize + gt[2] * ds.RasterYSize]
+    ys = [gt[3], gt[3] + gt[4] * ds.RasterXSize + gt[5] * ds.RasterYSize]
+    return [min(xs), min(ys), max(xs), max(ys)]
+
+def ortho_scale(ds):
+    #textures are 8 bit; other data types are scaled from the range of each band of the whole 
+    #orthophoto, hence, all tiles share the same scaling
+    band_list = ortho_bands(ds)
+    if all([ds.GetRasterBand(bx).DataType == gdal.GDT_Byte for bx in band_list]):
+        return None
+    return [list(ds.GetRasterBand(bx).ComputeRasterMinMax(True)) + [0, 255] for bx in band_list]
+
+def cut_ortho_tile(ds, tid, extent, odir, fmt="jpg", downsample=1, max_size=4096, scale=None):
+    
+    #gdal raises for windows completely outside of the orthophoto; e.g. if it covers less than the dgm. 
+    #Those tiles have no texture. Windows partially outside are still cut to the full extent of the tile, 
+    #as the uv coordinates refer to it; the part outside is filled with 0.
+    op_bounds = ortho_bounds(ds)
+    if (extent[0] >= op_bounds[2]) or (extent[2] <= op_bounds[0]) or (extent[1] >= op_bounds[3]) or (extent[3] <= op_bounds[1]):
+        return None
+    
+    op_gt = ds.GetGeoTransform()
+    size = texture_size(extent, abs(op_gt[1]), downsample=downsample, max_size=max_size)
+    
+    opath = os.path.join(odir, "%s.%s" % (tid, fmt))
+    band_list = ortho_bands(ds)
+    
+    if fmt == "jpg":
+        creation_opts = ["QUALITY=90"]
+    else:
+        creation_opts = []
+    
+    #gdal only reads the window of the orthophoto covered by projWin and resamples it to the texture size
+    gdal.Translate(opath, ds, 
+                   format=ORTHO_DRIVERS[fmt], 
+                   projWin=[extent[0], extent[3], extent[2], extent[1]], 
+                   width=size, height=size,
+                   bandList=band_list,
+                   outputType=gdal.GDT_Byte,
+                   scaleParams=scale,
+                   resampleAlg="average",
+                   creationOptions=creation_opts)
+    
+    #gdal stores the georeference in an additional .aux.xml; the viewer expects a single file per tile
+    if os.path.exists(opath + ".aux.xml"):
+        os.remove(opath + ".aux.xml")
+    
+    return opath
+
+def _init_ortho_worker(path):
+    _worker.op_ds = gdal.Open(path)
+
+def _cut_ortho_worker(job, odir, fmt, downsample, max_size, scale):
+    tid, extent = job
+    return cut_ortho_tile(_worker.op_ds, tid, extent, odir, fmt=fmt, downsample=downsample, max_size=max_size, scale=scale)
 
 class MeshGrid:
     
-    def __init__(self, path=None, tile_size=256, max_error=1):
+    def __init__(self, path=None, tile_size=256, max_error=1, workers=None, build=True, progress=None, canceled=None, max_triangles=None, error_cache=None):
         
         if path is None:
             raise ValueError("Path to the .tif must be provided.")
@@ -209,16 +699,70 @@ class MeshGrid:
          
         self.path = path
         self.tile_size = tile_size
-        self.max_error = max_error
-        self.data = {}
+        self.workers = workers
+        
+        #progress(stage, done, total) is called after each tile and seam; if canceled() returns True, 
+        #MeshGridCanceled is raised at the next tile; e.g. for running the conversion in a QgsTask
+        self.progress = progress
+        self.canceled = canceled
         
-        self.build()
+        #a list of errors creates one level of detail per error; the levels are named "1", "2", ...
+        #from the finest to the coarsest one and written to mesh/<olvl>
+        self.max_errors = sorted(np.atleast_1d(max_error).astype(float).tolist())
         
-    def build(self):
-        dgm_arr, dgm_gt, dgm_prj, dgm_h, dgm_w, dgm_nd = load_geoimg(self.path, nr_bands=1, band_dtype=np.float32)        
-        dgm_arr[dgm_arr == dgm_nd] = -1
+        #alternatively, each level has a budget of triangles per tile; the max_error of each tile is then searched 
+        #for the budget. Budgets are either the same for all tiles or given per tile id with a default
+        if max_triangles is None:
+            self.max_triangles = None
+        else:
+            if not isinstance(max_triangles, dict):
+                max_triangles = {"default":max_triangles}
+            if "default" not in max_triangles.keys():
+                raise ValueError("A default triangle budget must be provided.")
+            
+            self.max_triangles = {tid:sorted(np.atleast_1d(budget).astype(int).tolist(), reverse=True) for tid, budget in max_triangles.items()}
+            
+            nr_lvls = len(self.max_triangles["default"])
+            if any([len(budget) != nr_lvls for budget in self.max_triangles.values()]):
+                raise ValueError("Each tile must have a budget for each level of detail.")
+            
+            self.max_errors = [None] * nr_lvls
+        
+        self.levels = {"%i" % (lx+1):{} for lx in range(len(self.max_errors))}
+        self.set_level("1")
+        
+        self.init_grid()
+        
+        #error maps of the tiles are kept in <error_cache>/<dgm>_errors_<tile_size>.npy; simplifying the 
+        #same dgm with another max_error or budget then only extracts the meshes from the cached error maps
+        if error_cache is None:
+            self.error_cache = None
+        else:
+            cache_name = "%s_errors_%i.npy" % (os.path.splitext(os.path.basename(self.path))[0], self.tile_size-1)
+            self.error_cache = ErrorCache(os.path.join(error_cache, cache_name), self.nr_rows-1, self.nr_cols-1, self.tile_size)
         
-        dgm_prj = osr.SpatialReference(wkt=dgm_prj)
+        #without build the tiles are created later on; e.g. by rebuild() for the changed windows only
+        if build:
+            self.build()
+    
+    def report(self, stage, done, total):
+        if self.progress is not None:
+            self.progress(stage, done, total)
+        if self.canceled is not None and self.canceled():
+            raise MeshGridCanceled("%s canceled." % (stage))
+    
+    def set_level(self, olvl):
+        #all snapping and merging methods operate on self.data; hence, it points to the active level
+        self.olvl = olvl
+        self.data = self.levels[olvl]
+        self.max_error = self.max_errors[int(olvl)-1]
+    
+    def init_grid(self):
+        dgm_ds = gdal.Open(self.path)
+        dgm_h = dgm_ds.RasterYSize
+        dgm_w = dgm_ds.RasterXSize
+        
+        dgm_prj = osr.SpatialReference(wkt=dgm_ds.GetProjection())
         dgm_prj.AutoIdentifyEPSG()
         dgm_epsg = dgm_prj.GetAttrValue('AUTHORITY',1)
         self.epsg = dgm_epsg
@@ -237,12 +781,10 @@ class MeshGrid:
         
         #as we extract the dgm with 1 px overlay we adjust the tilesize after we calcutate the splits
         self.tile_size += 1
-        martini = Martini(self.tile_size)
         
+        self.windows = []
         for rx in range(len(r_steps)-1):
             for cx in range(len(c_steps)-1):
-        # for rx in range(len(r_steps)-1):
-        #     for cx in range(len(c_steps)-1):
                 
                 min_c = c_steps[cx]
                 max_c = c_steps[cx+1]+1 #1px overlap; Guranteees that the tilesize is 2**n+1
@@ -250,73 +792,79 @@ class MeshGrid:
                 min_r = r_steps[rx]
                 max_r = r_steps[rx+1]+1 #1px overlap; Guranteees that the tilesize is 2**n+1
                 
-                bounds_geo = px2geo(np.array([[min_r, min_c], 
-                                              [max_r, max_c]]), gt=dgm_gt)
-                
-                min_x_geo = np.min(bounds_geo[:, 0])
-                max_y_geo = np.max(bounds_geo[:, 1])
-                
-                tile_gt = (min_x_geo, dgm_gt[1], dgm_gt[2], max_y_geo, dgm_gt[4], dgm_gt[5])
-                tile_bbox = list(bounds_geo.ravel())
-                
-                tile_arr = dgm_arr[min_r:max_r, min_c:max_c]
-                tile_h, tile_w = np.shape(tile_arr)
-                
-                if tile_h != self.tile_size:
-                    tile_arr = np.pad(tile_arr, pad_width=((0,self.tile_size-tile_h),(0,0)), mode="constant", constant_values=-1)
-                
-                if tile_w != self.tile_size:
-                    tile_arr = np.pad(tile_arr, pad_width=((0,0),(0,self.tile_size-tile_w),), mode="constant", constant_values=-1)
-                
-                assert np.shape(tile_arr) == (self.tile_size, self.tile_size)
-                self.tile_size = np.shape(tile_arr)[0]
-                
-                tile = martini.create_tile(tile_arr)
-                vertices, triangles = tile.get_mesh(self.max_error)
-                
-                #martini returns vertices as col/row; we further use row/col; hence, np.fliplr
-                vertices = np.fliplr(vertices.reshape(-1, 2))
-                triangles = triangles.reshape(-1, 3)
-                                
-                vert_h = tile_arr[vertices[:, 0], vertices[:, 1]]
-                tris_vert_h = vert_h[triangles.ravel()].reshape(-1, 3)
-                 
-                valid_tix = np.nonzero(~np.any(tris_vert_h==-1, axis=1))[0]
-                if len(valid_tix) == 0:
-                    continue
-                
-                valid_tris = triangles[valid_tix, :]
-                valid_tris_vix, valid_tris_vix_ix, valid_tris_vix_inv = np.unique(valid_tris, return_inverse=True, return_index=True)
-                #inv for creating new ids of triangles
-                # ix for extracting the corresponding vertices
-                new_tris_vix = np.arange(len(valid_tris_vix))
-                
-                triangles = new_tris_vix[valid_tris_vix_inv].reshape(-1, 3)
-                vertices = vertices[valid_tris_vix, :]               
-                
-                mesh_tile = MeshTile(vertices=vertices, 
-                                     triangles=triangles, 
-                                     tile_size=self.tile_size,
-                                     tile_gt=tile_gt,
-                                     tile_arr=tile_arr,
-                                     bounds_local=[min_c, min_r, max_c, max_r],
-                                     bounds_geo=tile_bbox)
-                
-                self.data["%i_%i" % (rx, cx)] = mesh_tile
+                self.windows.append((rx, cx, min_r, max_r, min_c, max_c))
+        
+    def build(self, tids=None):
+        #the dgm is never loaded as a whole; each tile reads its own window (incl. the 1px overlap) 
+        #directly from the dataset; hence, memory only depends on the tile size
+        if tids is None:
+            windows = self.windows
+        else:
+            windows = [win for win in self.windows if "%i_%i" % (win[0], win[1]) in tids]
+        
+        budgets = [self.tile_budget("%i_%i" % (win[0], win[1])) for win in windows]
+        
+        if self.workers is None or self.workers <= 1:
+            dgm_ds = gdal.Open(self.path)
+            martini = Martini(self.tile_size)
+            mesh_tiles = (build_tile(dgm_ds, martini, win, self.tile_size, self.max_errors, max_triangles=budget, error_cache=self.error_cache) for win, budget in zip(windows, budgets))
+            self.add_tiles(windows, mesh_tiles)
+        else:
+            #each worker opens the dataset and creates the martini instance once; the windows are
+            #independent of each other and map() returns the tiles in the same order as the serial run
+            build_func = partial(_build_tile_worker, tile_size=self.tile_size, max_errors=self.max_errors)
+            chunksize = max(1, len(windows) // (self.workers * 4))
+            cache_path = self.error_cache.path if self.error_cache is not None else None
+            pool = worker_pool(self.workers, _init_worker, (self.path, self.tile_size, cache_path))
+            try:
+                self.add_tiles(windows, pool.map(build_func, zip(windows, budgets), chunksize=chunksize))
+            finally:
+                #on cancel the windows which are not started yet are dropped
+                pool.shutdown(wait=True, cancel_futures=True)
+    
+    def tile_budget(self, tid):
+        if self.max_triangles is None:
+            return None
+        return self.max_triangles.get(tid, self.max_triangles["default"])
+    
+    def window_hashes(self, workers=None):
+        #hashes of all windows of the dgm; reading a window is cheap compared to its simplification
+        if workers is None or workers <= 1:
+            dgm_ds = gdal.Open(self.path)
+            src_hashes = [hash_tile(dgm_ds, win, self.tile_size) for win in self.windows]
+        else:
+            hash_func = partial(_hash_tile_worker, tile_size=self.tile_size)
+            chunksize = max(1, len(self.windows) // (workers * 4))
+            with worker_pool(workers, _init_worker, (self.path, self.tile_size)) as pool:
+                src_hashes = list(pool.map(hash_func, self.windows, chunksize=chunksize))
+        
+        return {"%i_%i" % (win[0], win[1]):src_hash for win, src_hash in zip(self.windows, src_hashes)}
+    
+    def add_tiles(self, windows, mesh_tiles):
+        for wx, (win, lvl_tiles) in enumerate(zip(windows, mesh_tiles)):
+            for olvl, mesh_tile in zip(self.levels.keys(), lvl_tiles):
+                if mesh_tile is not None:
+                    self.levels[olvl]["%i_%i" % (win[0], win[1])] = mesh_tile
+            self.report("build", wx+1, len(windows))
 
-    def update_tid(self, tid, new_verts, new_tris, pop_tris):
+    def update_tid(self, tid, new_verts, new_heights, new_tris, pop_tris):
                     
-        self.data[tid].vertices = np.vstack((self.data[tid].vertices, np.array(new_verts)))
+        #all changes of a seam are applied at once
+        nr_verts = len(self.data[tid].vertices)
+        self.data[tid].vertices = np.vstack((self.data[tid].vertices, new_verts))
+        self.data[tid].heights = np.concatenate((self.data[tid].heights, new_heights)).astype(np.float32)
     
         upd_triangles = np.delete(self.data[tid].triangles, pop_tris, axis=0)
-        self.data[tid].triangles = np.vstack((upd_triangles, np.array(new_tris))).astype(np.uint32)
+        self.data[tid].triangles = np.vstack((upd_triangles, new_tris)).astype(np.uint32)
         
-        self.data[tid].extract_boundaries()
+        self.data[tid].update_boundaries(new_vix=np.arange(nr_verts, len(self.data[tid].vertices)),
+                                         pop_tix=pop_tris, 
+                                         new_tix=np.arange(len(upd_triangles), len(self.data[tid].triangles)))
         
         self.data[tid].nr_vertices = np.shape(self.data[tid].vertices)[0]
         self.data[tid].nr_triangles = np.shape(self.data[tid].triangles)[0]
                         
-    def snap(self, tid, missing_vix_coords, mode=None):
+    def snap(self, tid, missing_vix_coords, missing_vix_heights, mode=None):
         
         missing_vix_coords = missing_vix_coords.astype(np.uint32)
         
@@ -347,67 +895,86 @@ class MeshGrid:
         else:
             raise ValueError("%s not supported." % (mode))
         
-        #six is the index where coordinates of next must be inserted into curr to maintain order
-        missing_vix_coords_six = np.searchsorted(bdry_coords[:, bix].ravel(), missing_vix_coords, side="left")-1
-        uq_six, uq_six_inv = np.unique(missing_vix_coords_six, return_inverse=True)
-        
-        uq_six = uq_six[uq_six < len(bdry_trix)]            #sometimes the other border is longer than the current one; hence, clip those ranges
-        uq_six = uq_six[uq_six >= 0]
-        
-        if len(uq_six) == 0:
-            return [], [], []
-
-        max_vix = len(self.data[tid].vertices) - 1
-        
-        new_verts = []
-        new_tris = []
-        pop_tris = []
-        
-        for ix, six in enumerate(uq_six):
-                                
-            miss_coords = missing_vix_coords[np.nonzero(uq_six_inv == ix)[0]]
-            miss_vix = np.arange(max_vix+1, max_vix+1+len(miss_coords))
-            
-            for coord in miss_coords:                               
-                if mode in ["left", "right"]:
-                    new_verts.append([coord, bdry_const])#, coord_h])
-                elif mode in ["top", "bottom"]:
-                    new_verts.append([bdry_const, coord])#, coord_h])
-
-            trix_insert = bdry_trix[six]                                            #index of the triangle where the miss_coords will be inserted
-            trix_insert_vix = self.data[tid].triangles[trix_insert, :]              #vertex indices of the triangle
-            trix_insert_vix_coords = self.data[tid].vertices[trix_insert_vix, :]    #vertex coords of the triangle
-            
-            pop_tris.append(trix_insert)
-            
-            #get indixes within each triangle corresponding to the bdry and not ("norm");
-            #while use pymartini appaers that bdry edges are always the first two vertices this might
-            #not be always true;
-            bdry_ix = np.argwhere(trix_insert_vix_coords[:, not_bix] == bdry_const).ravel()
-            assert len(bdry_ix) == 2, "No valid boundary triangles for %s (%s)." % (tid, mode)
-            
-            norm_ix = np.setdiff1d(np.arange(3), bdry_ix)
-            
-            bdry_coords_ext = np.hstack((trix_insert_vix_coords[bdry_ix, bix], miss_coords))
-            bdry_vix = np.hstack((trix_insert_vix[bdry_ix], miss_vix))
-            
-            norm_vix = trix_insert_vix[norm_ix]
-            
-            bdry_coords_ext_ascix = np.argsort(bdry_coords_ext)
-            
-            bdry_coords_ext = bdry_coords_ext[bdry_coords_ext_ascix]
-            bdry_vix = bdry_vix[bdry_coords_ext_ascix]
-            
-            for bx in range(len(bdry_coords_ext)-1):
-                if mode == "right" or mode == "top":
-                    bx_tri = [bdry_vix[bx], bdry_vix[bx+1], norm_vix[0]]
-                elif mode == "left" or mode == "bottom":
-                    bx_tri = [bdry_vix[bx], norm_vix[0], bdry_vix[bx+1]]
-                new_tris.append(bx_tri)
-
-            max_vix = miss_vix[-1]
-
-        return new_verts, new_tris, pop_tris
+        #boundary edge [lo, hi] of each boundary triangle; the triangles are sorted by hi and their edges do not 
+        #overlap. The boundary might have gaps (e.g. nodata); hence, six is the first triangle ending after a 
+        #missing coordinate, which only holds the coordinate if its edge starts before it. Coordinates within 
+        #gaps or beyond the ends of the boundary are not inserted.
+        bdry_tri_coords = self.data[tid].vertices[self.data[tid].triangles[bdry_trix, :], :].astype(np.int64)
+        on_bdry = bdry_tri_coords[:, :, not_bix] == bdry_const
+        bdry_lo = np.min(np.where(on_bdry, bdry_tri_coords[:, :, bix], np.iinfo(np.int64).max), axis=1)
+        bdry_hi = np.max(np.where(on_bdry, bdry_tri_coords[:, :, bix], -1), axis=1)
+        
+        missing_vix_asc = np.argsort(missing_vix_coords)
+        missing_vix_coords = missing_vix_coords[missing_vix_asc]
+        missing_vix_heights = missing_vix_heights[missing_vix_asc]
+        missing_vix_coords_six = np.searchsorted(bdry_hi, missing_vix_coords, side="left")
+        
+        valid_six = missing_vix_coords_six < len(bdry_trix)
+        valid_six[valid_six] = bdry_lo[missing_vix_coords_six[valid_six]] < missing_vix_coords[valid_six]
+        miss_coords = missing_vix_coords[valid_six]
+        miss_heights = missing_vix_heights[valid_six]
+        miss_six = missing_vix_coords_six[valid_six]
+        
+        if len(miss_coords) == 0:
+            return [], [], [], []
+        
+        #all missing coordinates with the same six are inserted into the same boundary triangle; as the 
+        #coordinates are sorted, the coordinates of each triangle are contiguous
+        uq_six, uq_six_start, uq_six_cnt = np.unique(miss_six, return_index=True, return_counts=True)
+        
+        miss_vix = np.arange(len(miss_coords)) + len(self.data[tid].vertices)
+        miss_const = np.full(len(miss_coords), bdry_const)
+        
+        if mode in ["left", "right"]:
+            new_verts = np.column_stack((miss_coords, miss_const))
+        elif mode in ["top", "bottom"]:
+            new_verts = np.column_stack((miss_const, miss_coords))
+        new_verts = new_verts.astype(self.data[tid].vertices.dtype)
+        
+        trix_insert = bdry_trix[uq_six]                                         #index of the triangles where the miss_coords will be inserted
+        trix_insert_vix = self.data[tid].triangles[trix_insert, :]              #vertex indices of the triangles
+        trix_insert_vix_coords = self.data[tid].vertices[trix_insert_vix, :]    #vertex coords of the triangles
+        
+        #get indixes within each triangle corresponding to the bdry and not ("norm");
+        #while use pymartini appaers that bdry edges are always the first two vertices this might
+        #not be always true;
+        is_bdry = trix_insert_vix_coords[:, :, not_bix] == bdry_const
+        assert np.all(np.count_nonzero(is_bdry, axis=1) == 2), "No valid boundary triangles for %s (%s)." % (tid, mode)
+        
+        norm_vix = trix_insert_vix[~is_bdry]
+        bdry_vix = trix_insert_vix[is_bdry].reshape(-1, 2)
+        bdry_vix_coords = trix_insert_vix_coords[:, :, bix][is_bdry].reshape(-1, 2)
+        bdry_vix = np.take_along_axis(bdry_vix, np.argsort(bdry_vix_coords, axis=1), axis=1)
+        
+        #for each triangle build the chain of its lower boundary vertex, the inserted vertices and 
+        #its upper boundary vertex; all chains are concatenated into one array
+        chain_len = uq_six_cnt + 2
+        chain_start = np.cumsum(chain_len) - chain_len
+        chain_end = chain_start + chain_len - 1
+        
+        miss_grp = np.repeat(np.arange(len(uq_six)), uq_six_cnt)
+        
+        chain = np.empty(np.sum(chain_len), dtype=np.int64)
+        chain[chain_start] = bdry_vix[:, 0]
+        chain[chain_end] = bdry_vix[:, 1]
+        chain[chain_start[miss_grp] + 1 + np.arange(len(miss_coords)) - uq_six_start[miss_grp]] = miss_vix
+        
+        #consecutive vertices within a chain are the boundary edge of one new triangle; 
+        #the step from the end of one chain to the start of the next one is not an edge
+        is_edge = np.ones(len(chain)-1, dtype=bool)
+        is_edge[chain_end[:-1]] = False
+        
+        edge_start = chain[:-1][is_edge]
+        edge_end = chain[1:][is_edge]
+        edge_norm = np.repeat(norm_vix, uq_six_cnt + 1)
+        
+        if mode == "right" or mode == "top":
+            new_tris = np.column_stack((edge_start, edge_end, edge_norm))
+        elif mode == "left" or mode == "bottom":
+            new_tris = np.column_stack((edge_start, edge_norm, edge_end))
+        
+        #inserted vertices are the boundary vertices of the neighbouring tile; hence, they share its heights
+        return new_verts, miss_heights, new_tris, trix_insert
     
     def snap_boundaries_left_right(self, left_tid, right_tid):
                                    
@@ -417,17 +984,23 @@ class MeshGrid:
         
         # # #vertices which are not on the border of the one tile but on the other; 
         # # #we use the column coords of the vertices as indicator for left/right case: 
-        # # setdiff1d(a,b) - returns the values of a not in b; to get the indices we further need to use isin
-        right_missing_vix_coords = np.setdiff1d(left_bv_coords[:, 0], right_bv_coords[:, 0])  #coords missing in next but in curr
-        left_missing_vix_coords = np.setdiff1d(right_bv_coords[:, 0], left_bv_coords[:, 0])  #coords missing in curr but in next
+        # # isin(a,b, invert=True) - returns the values of a not in b; the heights are taken from the tile 
+        # # which has the vertex
+        right_missing_ix = np.isin(left_bv_coords[:, 0], right_bv_coords[:, 0], invert=True)  #coords missing in next but in curr
+        left_missing_ix = np.isin(right_bv_coords[:, 0], left_bv_coords[:, 0], invert=True)  #coords missing in curr but in next
+        
+        right_missing_vix_coords = left_bv_coords[right_missing_ix, 0]
+        right_missing_vix_heights = self.data[left_tid].heights[self.data[left_tid].r_vix[right_missing_ix]]
+        left_missing_vix_coords = right_bv_coords[left_missing_ix, 0]
+        left_missing_vix_heights = self.data[right_tid].heights[self.data[right_tid].l_vix[left_missing_ix]]
         
-        l_new_verts, l_new_tris, l_pop_tris = self.snap(left_tid, left_missing_vix_coords, mode="left")
-        r_new_verts, r_new_tris, r_pop_tris = self.snap(right_tid, right_missing_vix_coords, mode="right")
+        l_new_verts, l_new_heights, l_new_tris, l_pop_tris = self.snap(left_tid, left_missing_vix_coords, left_missing_vix_heights, mode="left")
+        r_new_verts, r_new_heights, r_new_tris, r_pop_tris = self.snap(right_tid, right_missing_vix_coords, right_missing_vix_heights, mode="right")
         
         if len(l_new_verts) > 0:
-            self.update_tid(left_tid, l_new_verts, l_new_tris, l_pop_tris)
+            self.update_tid(left_tid, l_new_verts, l_new_heights, l_new_tris, l_pop_tris)
         if len(r_new_verts) > 0:
-            self.update_tid(right_tid, r_new_verts, r_new_tris, r_pop_tris)
+            self.update_tid(right_tid, r_new_verts, r_new_heights, r_new_tris, r_pop_tris)
     
     def snap_boundaries_top_bottom(self, top_tid, bottom_tid):
                                    
@@ -437,45 +1010,98 @@ class MeshGrid:
         
         # # #vertices which are not on the border of the one tile but on the other; 
         # # #we use the column coords of the vertices as indicator for left/right case: 
-        # # setdiff1d(a,b) - returns the values of a not in b; to get the indices we further need to use isin
-        top_missing_vix_coords = np.setdiff1d(bot_bv_coords[:, 1], top_bv_coords[:, 1])  #coords missing in next but in curr
-        bot_missing_vix_coords = np.setdiff1d(top_bv_coords[:, 1], bot_bv_coords[:, 1])  #coords missing in curr but in next
+        # # isin(a,b, invert=True) - returns the values of a not in b; the heights are taken from the tile 
+        # # which has the vertex
+        top_missing_ix = np.isin(bot_bv_coords[:, 1], top_bv_coords[:, 1], invert=True)  #coords missing in next but in curr
+        bot_missing_ix = np.isin(top_bv_coords[:, 1], bot_bv_coords[:, 1], invert=True)  #coords missing in curr but in next
         
-        t_new_verts, t_new_tris, t_pop_tris = self.snap(top_tid, top_missing_vix_coords, mode="top")
-        b_new_verts, b_new_tris, b_pop_tris = self.snap(bottom_tid, bot_missing_vix_coords, mode="bottom")
+        top_missing_vix_coords = bot_bv_coords[top_missing_ix, 1]
+        top_missing_vix_heights = self.data[bottom_tid].heights[self.data[bottom_tid].t_vix[top_missing_ix]]
+        bot_missing_vix_coords = top_bv_coords[bot_missing_ix, 1]
+        bot_missing_vix_heights = self.data[top_tid].heights[self.data[top_tid].b_vix[bot_missing_ix]]
+        
+        t_new_verts, t_new_heights, t_new_tris, t_pop_tris = self.snap(top_tid, top_missing_vix_coords, top_missing_vix_heights, mode="top")
+        b_new_verts, b_new_heights, b_new_tris, b_pop_tris = self.snap(bottom_tid, bot_missing_vix_coords, bot_missing_vix_heights, mode="bottom")
         
         if len(t_new_verts) > 0:
-            self.update_tid(top_tid, t_new_verts, t_new_tris, t_pop_tris)
+            self.update_tid(top_tid, t_new_verts, t_new_heights, t_new_tris, t_pop_tris)
         if len(b_new_verts) > 0:
-            self.update_tid(bottom_tid, b_new_verts, b_new_tris, b_pop_tris)
+            self.update_tid(bottom_tid, b_new_verts, b_new_heights, b_new_tris, b_pop_tris)
+    
+    def snap_boundaries(self, workers=None):
+        #levels are independent of each other; each one is snapped on its own
+        active_lvl = self.olvl
+        
+        lvl_waves = {}
+        for olvl in self.levels.keys():
+            self.set_level(olvl)
+            lvl_waves[olvl] = self.seam_waves()
+        
+        #progress is reported over the seams of all levels
+        self.nr_seams = sum([len(wave) for waves in lvl_waves.values() for wave in waves])
+        self.nr_snapped = 0
+        
+        for olvl, waves in lvl_waves.items():
+            self.set_level(olvl)
+            self.snap_level(workers=workers, waves=waves)
+        self.set_level(active_lvl)
     
-    def snap_boundaries(self):
+    def seam_waves(self):
         rows = range(0, self.nr_rows-1)
         cols = range(0, self.nr_cols-1)
         
+        #seams within one wave never share a tile; hence, they can be snapped at the same time. Tiles 
+        #sharing a corner triangle between two of their boundaries depend on the order of the seams: the
+        #top seam must be snapped before the left and right seam and those before the lower one. Thus, each
+        #row is processed in three waves: vertical seams at even columns, at odd columns and the lower seams
+        waves = []
         for r in rows:
+            for cols_parity in [cols[0::2], cols[1::2]]:
+                wave = []
+                for c in cols_parity:
+                    curr_tid = "%s_%s" % (r, c)
+                    right_tid = "%s_%s" % (r, c+1)
+                    if (curr_tid in self.data.keys()) and (right_tid in self.data.keys()):
+                        wave.append(("left_right", curr_tid, right_tid))
+                waves.append(wave)
+            
+            wave = []
             for c in cols:
                 curr_tid = "%s_%s" % (r, c)
-                if curr_tid not in self.data.keys():
-                    continue
-                
-                if c+1 <= cols[-1]:
-                    right_tid = "%s_%s" % (r, c+1)
-                    if right_tid not in self.data.keys():
-                        right_tid = None
-                else:
-                    right_tid = None
-                if r+1 <= rows[-1]:
-                    lower_tid = "%s_%s" % (r+1, c)
-                    if lower_tid not in self.data.keys():
-                        lower_tid = None
-                else:
-                    lower_tid = None
-                
-                if right_tid:
-                    self.snap_boundaries_left_right(left_tid=curr_tid, right_tid=right_tid)
-                if lower_tid:
-                    self.snap_boundaries_top_bottom(top_tid=curr_tid, bottom_tid=lower_tid)
+                lower_tid = "%s_%s" % (r+1, c)
+                if (curr_tid in self.data.keys()) and (lower_tid in self.data.keys()):
+                    wave.append(("top_bottom", curr_tid, lower_tid))
+            waves.append(wave)
+        
+        return [wave for wave in waves if len(wave) > 0]
+    
+    def snap_seam(self, seam):
+        mode, curr_tid, next_tid = seam
+        if mode == "left_right":
+            self.snap_boundaries_left_right(left_tid=curr_tid, right_tid=next_tid)
+        elif mode == "top_bottom":
+            self.snap_boundaries_top_bottom(top_tid=curr_tid, bottom_tid=next_tid)
+    
+    def snap_level(self, workers=None, waves=None):
+        if waves is None:
+            waves = self.seam_waves()
+            self.nr_seams = sum([len(wave) for wave in waves])
+            self.nr_snapped = 0
+        
+        if workers is None or workers <= 1:
+            for wave in waves:
+                for seam in wave:
+                    self.snap_seam(seam)
+                    self.nr_snapped += 1
+                    self.report("snap", self.nr_snapped, self.nr_seams)
+        else:
+            #snapping only changes the two tiles of a seam; as tiles are not shared within a wave, 
+            #threads can work on the same MeshGrid without copying the tiles to other processes
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                for wave in waves:
+                    for _ in pool.map(self.snap_seam, wave):
+                        self.nr_snapped += 1
+                        self.report("snap", self.nr_snapped, self.nr_seams)
         
     # def to_json(self, path):
         
@@ -504,7 +1130,19 @@ class MeshGrid:
     #     with open(path, 'w') as f:
     #         dump(tile_collection, f)
     
-    def save_tiles(self, odir, olvl="1", save_json=True):
+    def save_tiles(self, odir, olvl=None, save_json=True, fmt="mqt", quantize=False, reorder=True, log_acmr=False):
+        
+        #without olvl all levels of detail are written; each one to mesh/<olvl>
+        if olvl is None:
+            olvls = list(self.levels.keys())
+        else:
+            olvls = [olvl]
+        
+        #tiles are written to the binary container by default; ply is kept as export option
+        if fmt not in ["mqt", "ply"]:
+            raise ValueError("%s not supported." % (fmt))
+        if quantize and fmt != "mqt":
+            raise ValueError("Quantization is only supported for mqt.")
                
         if not os.path.exists(odir):
             os.mkdir(odir)
@@ -512,102 +1150,296 @@ class MeshGrid:
         rows = range(0, self.nr_rows-1)
         cols = range(0, self.nr_cols-1)
         
-        global_min_x = np.inf
-        global_min_y = np.inf
-        global_min_z = np.inf
+        for lvl in olvls:
+            odir_mesh = os.path.join(odir, "mesh", lvl)
+            if not os.path.exists(odir_mesh):
+                os.makedirs(odir_mesh)
         
-        global_max_x = -np.inf
-        global_max_y = -np.inf
-        global_max_z = -np.inf
+        tile_meta_list = []
         
-        meta = {}
+        #quantized heights of all tiles refer to the same range; otherwise, the vertices on the seams of 
+        #neighbouring tiles would decode to different heights
+        z_range = self.height_range(olvls) if quantize else None
+        
+        #tipsify is a python loop per tile; with workers the orders are searched in the pool ahead of writing. 
+        #map() yields them in the same order as save_tile consumes them: row by row and level by level
+        pool = None
+        tri_orders = None
+        if reorder and self.workers is not None and self.workers > 1:
+            jobs = []
+            for r in rows:
+                for c in cols:
+                    tid = "%s_%s" % (r, c)
+                    jobs += [(self.levels[lvl][tid].triangles, self.levels[lvl][tid].nr_vertices) for lvl in olvls if tid in self.levels[lvl].keys()]
+            chunksize = max(1, len(jobs) // (self.workers * 4))
+            pool = worker_pool(self.workers, None, ())
+            tri_orders = pool.map(_tipsify_worker, jobs, chunksize=chunksize)
+        
+        try:
+            for r in rows:
+                for c in cols:
+                    tile_meta = self.save_tile(odir, "%s_%s" % (r, c), olvls, fmt=fmt, quantize=quantize, reorder=reorder, z_range=z_range, 
+                                               tri_orders=tri_orders, log_acmr=log_acmr)
+                    if tile_meta is not None:
+                        tile_meta_list.append(tile_meta)
+                    self.report("save", r*len(cols) + c + 1, len(rows)*len(cols))
+        finally:
+            if pool is not None:
+                pool.shutdown(wait=True, cancel_futures=True)
         
-        tidi = 0
+        if save_json:
+            self.save_meta(odir, tile_meta_list, olvls, fmt=fmt, quantize=quantize, z_range=z_range)
+    
+    def height_range(self, olvls):
+        heights = [tile.heights for lvl in olvls for tile in self.levels[lvl].values()]
+        if len(heights) == 0:
+            return None
+        return [float(np.min([np.min(h) for h in heights])), float(np.max([np.max(h) for h in heights]))]
+    
+    def save_tile(self, odir, tid, olvls, fmt="mqt", quantize=False, reorder=True, z_range=None, tri_orders=None, log_acmr=False):
         
-        tile_meta_list = []
+        #coarser levels might lose tiles with only a few valid triangles; 
+        #hence, a tile is listed as soon as it exists in any level
+        tile_lvls = [lvl for lvl in olvls if tid in self.levels[lvl].keys()]
+        if len(tile_lvls) == 0:
+            return None
         
-        odir_mesh = os.path.join(odir, "mesh", olvl)
-        if not os.path.exists(odir_mesh):
-            os.makedirs(odir_mesh)
+        tile_meta = {}
+        tile_meta["tid"] = tid
+        tile_meta["lods"] = {}
         
-        for r in rows:
-            for c in cols:
-                
-                tile_meta = {}
+        min_xyz = np.full(3, np.inf)
+        max_xyz = np.full(3, -np.inf)
+        
+        for lvl in tile_lvls:
+        
+            opath = os.path.join(odir, "mesh", lvl, "%s.%s" % (tid, fmt))
             
-                curr_tid = "%s_%s" % (r, c)
-                
-                if curr_tid not in self.data.keys():
-                    continue
-                
-                tile_meta["tid"] = curr_tid
-                tile_meta["tid_int"] = tidi
-                
-                opath = os.path.join(odir_mesh, "%s.ply" % (curr_tid))
-                
-                curr_tile = self.data[curr_tid]
-                
-                verts = curr_tile.vertices                        
-                verts_h = curr_tile.tile_arr[verts[:, 0], verts[:, 1]]
-                #tile_gt already contains the pixel shift towards the center; Hence, we don't add it again
-                verts_geo = np.hstack((px2geo(verts, curr_tile.tile_gt, pixel_shift=False), verts_h.reshape(-1, 1)))
-                
-                min_xyz = np.min(verts_geo, axis=0)
-                max_xyz = np.max(verts_geo, axis=0)
-                cx_xyz = ((min_xyz + max_xyz)/2.)
-                cx_rad = np.max(np.sqrt(np.sum((verts_geo[:, :2]-cx_xyz[:2])**2,axis=1)))
-                
-                if min_xyz[0] < global_min_x:
-                    global_min_x = min_xyz[0]
-                if min_xyz[1] < global_min_y:
-                    global_min_y = min_xyz[1]
-                if min_xyz[2] < global_min_z:
-                    global_min_z = min_xyz[2]
-                
-                if max_xyz[0] > global_max_x:
-                    global_max_x = max_xyz[0]
-                if max_xyz[1] > global_max_y:
-                    global_max_y = max_xyz[1]
-                if max_xyz[2] > global_max_z:
-                    global_max_z = max_xyz[2]
-                                
-                tile_meta["min_xyz"] = np.round(min_xyz, 3).ravel().tolist()
-                tile_meta["max_xyz"] = np.round(max_xyz, 3).ravel().tolist()
-                tile_meta["cx_r"] = np.round(cx_xyz, 3).ravel().tolist() + [np.round(cx_rad, 1)]
-                tile_meta_list.append(tile_meta)
-                
-                tris = curr_tile.triangles
-
+            curr_tile = self.levels[lvl][tid]
+            
+            #post processing for rendering and the bvh of the raycasting; the order of martini and the 
+            #triangles appended by snapping have a poor reuse of vertices. The acmr is a python loop as well; 
+            #hence, it is only computed for the log in tiles.json
+            if reorder:
+                if log_acmr:
+                    acmr_before = acmr(curr_tile.triangles)
+                curr_tile.reorder(tri_order=next(tri_orders) if tri_orders is not None else None)
+            
+            verts_geo = curr_tile.vertices_geo()
+            
+            min_xyz = np.minimum(min_xyz, np.min(verts_geo, axis=0))
+            max_xyz = np.maximum(max_xyz, np.max(verts_geo, axis=0))
+            
+            tris = curr_tile.triangles
+            
+            if fmt == "mqt":
+                write_tile_bin(opath, curr_tile, tid, curr_tile.max_error, quantize=quantize, z_range=z_range)
+            else:
                 o3d_mesh = o3d.geometry.TriangleMesh(vertices=o3d.utility.Vector3dVector(verts_geo),
                                                      triangles=o3d.utility.Vector3iVector(tris))
                 o3d_mesh.remove_duplicated_vertices()
                 
                 o3d.io.write_triangle_mesh(opath, o3d_mesh)
-
-                tidi += 1
-                
+            
+            tile_meta["lods"][lvl] = {"nrv":int(curr_tile.nr_vertices), 
+                                      "nrt":int(curr_tile.nr_triangles),
+                                      "max_error":round(float(curr_tile.max_error), 3)}
+            if reorder and log_acmr:
+                tile_meta["lods"][lvl]["acmr"] = [round(acmr_before, 3), round(acmr(curr_tile.triangles), 3)]
+            
+            #all levels are built from the same window; hence, they share the hash
+            tile_meta["src_hash"] = curr_tile.src_hash
+        
+        #the bounding sphere is only based on the extent; hence, it covers all levels 
+        cx_xyz = ((min_xyz + max_xyz)/2.)
+        cx_rad = np.sqrt(np.sum((max_xyz[:2]-cx_xyz[:2])**2))
+                        
+        tile_meta["min_xyz"] = np.round(min_xyz, 3).ravel().tolist()
+        tile_meta["max_xyz"] = np.round(max_xyz, 3).ravel().tolist()
+        tile_meta["cx_r"] = np.round(cx_xyz, 3).ravel().tolist() + [np.round(cx_rad, 1)]
+        tile_meta["extent"] = self.levels[tile_lvls[0]][tid].extent_geo().tolist()
+        
+        #only tiles without gaps in any level occlude other tiles in the viewer (see helpers.horizon_occlusion)
+        tile_meta["full"] = (len(tile_lvls) == len(olvls)) and all([self.levels[lvl][tid].is_full() for lvl in tile_lvls])
+        
+        return tile_meta
+    
+    def save_meta(self, odir, tile_meta_list, olvls, fmt="mqt", quantize=False, z_range=None):
+        
+        #tid_int is the position of the tile in tiles.json; tiles are listed row by row
+        tile_meta_list = sorted(tile_meta_list, key=lambda t: [int(x) for x in t["tid"].split("_")])
+        for tidi, tile_meta in enumerate(tile_meta_list):
+            tile_meta["tid_int"] = tidi
+        
+        global_min_xyz = np.min([t["min_xyz"] for t in tile_meta_list], axis=0)
+        global_max_xyz = np.max([t["max_xyz"] for t in tile_meta_list], axis=0)
+        
+        meta = {}
         meta["epsg"] = self.epsg
-        meta["min_xyz"] = [round(global_min_x, 3), round(global_min_y, 3), round(global_min_z, 3)]
-        meta["max_xyz"] = [round(global_max_x, 3), round(global_max_y, 3), round(global_max_z, 3)]
-        meta["cx"] = [round((global_min_x + global_max_x)/2., 3),
-                      round((global_min_y + global_max_y)/2., 3),
-                      round((global_min_z + global_max_z)/2., 3)]
+        meta["min_xyz"] = np.round(global_min_xyz, 3).tolist()
+        meta["max_xyz"] = np.round(global_max_xyz, 3).tolist()
+        meta["cx"] = np.round((global_min_xyz + global_max_xyz)/2., 3).tolist()
+        meta["tile_size"] = self.tile_size - 1
+        meta["lods"] = [{"olvl":lvl, 
+                         "max_error":self.max_errors[int(lvl)-1], 
+                         "max_triangles":None if self.max_triangles is None else self.max_triangles["default"][int(lvl)-1]} for lvl in olvls]
+        
+        #acmr of each level weighted by the number of triangles of the tiles
+        for lod in meta["lods"]:
+            lvl_tiles = [t["lods"][lod["olvl"]] for t in tile_meta_list if "acmr" in t["lods"].get(lod["olvl"], {}).keys()]
+            if len(lvl_tiles) > 0:
+                lvl_nrt = np.array([t["nrt"] for t in lvl_tiles])
+                lvl_acmr = np.array([t["acmr"] for t in lvl_tiles])
+                lod["acmr"] = np.round(np.sum(lvl_acmr * lvl_nrt.reshape(-1, 1), axis=0) / np.sum(lvl_nrt), 3).tolist()
+        meta["format"] = fmt
+        meta["quantized"] = quantize
+        if quantize:
+            meta["z_range"] = z_range
+        
+        #the source DTM allows exact ray intersections without the simplification error of the tiles; the 
+        #min/max of its blocks are written next to tiles.json; hence, the viewer does not read the whole DTM
+        meta["dtm_path"] = os.path.abspath(self.path)
+        DtmRaycaster(self.path, build=False).init_block_levels(os.path.join(odir, BLOCKS_FILE))
         
         meta["tiles"] = tile_meta_list
+        meta["index"] = build_tile_index(tile_meta_list)
         
-        if save_json:
-            with open(os.path.join(odir, "tiles.json"), 'w') as f:
-                dump(meta, f, indent=4)
+        with open(os.path.join(odir, "tiles.json"), 'w') as f:
+            dump(meta, f, indent=4)
+    
+    def rebuild(self, odir, workers=None):
+        
+        #tiles.json of a previous run; only tiles with a changed source window and their neighbours are 
+        #written again. The neighbours must be written as well, as the seams to the changed tiles change.
+        with open(os.path.join(odir, "tiles.json"), "r") as f:
+            meta = load(f)
+        
+        olvls = [lod["olvl"] for lod in meta.get("lods", [])]
+        if meta.get("tile_size") != self.tile_size - 1:
+            raise ValueError("Tile size differs from the one of %s." % (odir))
+        if [lod["max_error"] for lod in meta["lods"]] != [self.max_errors[int(olvl)-1] for olvl in olvls]:
+            raise ValueError("Levels of detail differ from the ones of %s." % (odir))
+        if self.max_triangles is not None:
+            if [lod.get("max_triangles") for lod in meta["lods"]] != [self.max_triangles["default"][int(olvl)-1] for olvl in olvls]:
+                raise ValueError("Triangle budgets differ from the ones of %s." % (odir))
+        
+        #hashing and snapping use the same number of workers; by default the one of the grid
+        if workers is None:
+            workers = self.workers
+        
+        old_hashes = {t["tid"]:t.get("src_hash") for t in meta["tiles"]}
+        new_hashes = self.window_hashes(workers=workers)
+        
+        #windows without any valid pixel never produce a tile; hence, their hash is None as for 
+        #windows which are not listed in tiles.json
+        dirty_tids = set([tid for tid, src_hash in new_hashes.items() if src_hash != old_hashes.get(tid)])
+        if len(dirty_tids) == 0:
+            return []
+        
+        #the neighbours of the written tiles are simplified as well; their boundaries are required to 
+        #snap the seams of the written tiles to the same vertices as in the previous run
+        write_tids = dirty_tids | self.neighbours(dirty_tids)
+        build_tids = write_tids | self.neighbours(write_tids)
+        
+        self.levels = {olvl:{} for olvl in self.levels.keys()}
+        self.set_level(self.olvl)
+        
+        self.build(tids=build_tids)
+        self.snap_boundaries(workers=workers)
+        
+        #quantized tiles are written with the height range of tiles.json; if the changed tiles exceed it, 
+        #all tiles are written again with the new range
+        quantize = meta.get("quantized", False)
+        z_range = None
+        if quantize:
+            z_range = meta.get("z_range")
+            lvl_range = self.height_range(olvls)
+            if (z_range is None) or (lvl_range[0] < z_range[0]) or (lvl_range[1] > z_range[1]):
+                write_tids = set(new_hashes.keys())
+                
+                self.levels = {olvl:{} for olvl in self.levels.keys()}
+                self.set_level(self.olvl)
+                
+                self.build()
+                self.snap_boundaries(workers=workers)
+                z_range = self.height_range(olvls)
         
-    def merge_tiles(self, opath):
+        tile_meta_list = [t for t in meta["tiles"] if t["tid"] not in write_tids]
         
-        out_verts = None
-        out_tris = None
+        for tid in write_tids:
+            
+            #tiles might vanish in single levels of detail; their previous files must not remain
+            for lvl in olvls:
+                opath = os.path.join(odir, "mesh", lvl, "%s.%s" % (tid, meta["format"]))
+                if (tid not in self.levels[lvl].keys()) and os.path.exists(opath):
+                    os.remove(opath)
+            
+            tile_meta = self.save_tile(odir, tid, olvls, fmt=meta["format"], quantize=quantize, z_range=z_range)
+            if tile_meta is not None:
+                tile_meta_list.append(tile_meta)
+        
+        self.save_meta(odir, tile_meta_list, olvls, fmt=meta["format"], quantize=quantize, z_range=z_range)
+        
+        return sorted(write_tids)
+    
+    def cut_orthophoto(self, op_path, odir, fmt="jpg", downsample=1, max_size=4096, workers=None):
+        
+        if not os.path.exists(op_path):
+            raise FileNotFoundError("Not a valid path.")
+        if fmt not in ORTHO_DRIVERS.keys():
+            raise ValueError("%s not supported." % (fmt))
+        
+        #textures are written next to the mesh; i.e. to op/<tid>.<fmt> as expected by the viewer
+        odir_op = os.path.join(odir, "op")
+        if not os.path.exists(odir_op):
+            os.makedirs(odir_op)
+        
+        #all levels of detail of a tile share the extent and, hence, the texture
+        jobs = []
+        for r in range(0, self.nr_rows-1):
+            for c in range(0, self.nr_cols-1):
+                curr_tid = "%s_%s" % (r, c)
+                for lvl in self.levels.keys():
+                    if curr_tid in self.levels[lvl].keys():
+                        jobs.append((curr_tid, self.levels[lvl][curr_tid].extent_geo()))
+                        break
         
+        op_ds = gdal.Open(op_path)
+        scale = ortho_scale(op_ds)
+        
+        if workers is None or workers <= 1:
+            op_paths = [cut_ortho_tile(op_ds, tid, extent, odir_op, fmt=fmt, downsample=downsample, max_size=max_size, scale=scale) for tid, extent in jobs]
+        else:
+            cut_func = partial(_cut_ortho_worker, odir=odir_op, fmt=fmt, downsample=downsample, max_size=max_size, scale=scale)
+            with worker_pool(workers, _init_ortho_worker, (op_path, )) as pool:
+                op_paths = list(pool.map(cut_func, jobs))
+        
+        #tiles outside of the orthophoto have no texture
+        return [opath for opath in op_paths if opath is not None]
+    
+    def neighbours(self, tids):
+        nbr_tids = set()
+        for tid in tids:
+            r, c = [int(x) for x in tid.split("_")]
+            for nr, nc in [(r-1, c), (r+1, c), (r, c-1), (r, c+1)]:
+                if (0 <= nr < self.nr_rows-1) and (0 <= nc < self.nr_cols-1):
+                    nbr_tids.add("%i_%i" % (nr, nc))
+        return nbr_tids - set(tids)
+        
+    def weld_tiles(self):
+        
+        #yields the tiles of the active level in row-major order with the global vertex index of each vertex; 
+        #seam vertices get the index of the same vertex in the upper/left tile. After snapping both tiles 
+        #of a seam have the same boundary vertices; hence, those are found with the boundary indices and no
+        #search for duplicates is required. Only the indices of the previous and current row are kept.
         rows = range(0, self.nr_rows-1)
         cols = range(0, self.nr_cols-1)
         
+        prev_gids = {}
+        nr_gids = 0
+        
         for r in rows:
+            curr_gids = {}
             for c in cols:
                 curr_tid = "%s_%s" % (r, c)
                 
@@ -615,26 +1447,101 @@ class MeshGrid:
                     continue
                 
                 curr_tile = self.data[curr_tid]
+                gid = np.full(curr_tile.nr_vertices, -1, dtype=np.int64)
+                
+                #(neighbour gids, neighbour tile, boundary of the neighbour, boundary of the current tile, coordinate along the seam)
+                seams = []
+                if "%s_%s" % (r-1, c) in prev_gids.keys():
+                    top_tid = "%s_%s" % (r-1, c)
+                    seams.append((prev_gids[top_tid], self.data[top_tid], self.data[top_tid].b_vix, curr_tile.t_vix, 1))
+                if "%s_%s" % (r, c-1) in curr_gids.keys():
+                    left_tid = "%s_%s" % (r, c-1)
+                    seams.append((curr_gids[left_tid], self.data[left_tid], self.data[left_tid].r_vix, curr_tile.l_vix, 0))
                 
-                verts = curr_tile.vertices                        
-                verts_h = curr_tile.tile_arr[verts[:, 0], verts[:, 1]]
-                #tile_gt already contains the pixel shift towards the center; Hence, we don't add it again
-                verts_geo = np.hstack((px2geo(verts, curr_tile.tile_gt, pixel_shift=False), verts_h.reshape(-1, 1)))
+                for nbr_gid, nbr_tile, nbr_vix, curr_vix, bix in seams:
+                    _, curr_ix, nbr_ix = np.intersect1d(curr_tile.vertices[curr_vix, bix], 
+                                                        nbr_tile.vertices[nbr_vix, bix], 
+                                                        return_indices=True)
+                    gid[curr_vix[curr_ix]] = nbr_gid[nbr_vix[nbr_ix]]
                 
-                tris = curr_tile.triangles
+                #the upper corners might only be shared with the diagonal neighbours
+                corners = [("%s_%s" % (r-1, c-1), 0, self.tile_size-1), 
+                           ("%s_%s" % (r-1, c+1), self.tile_size-1, 0)]
                 
-                if out_verts is None:
-                    out_verts = verts_geo
-                    out_tris = tris
-                else:
+                for diag_tid, curr_col, diag_col in corners:
+                    if (diag_tid not in prev_gids.keys()) or (len(curr_tile.t_vix) == 0):
+                        continue
                     
-                    tris += int(np.shape(out_verts)[0])
+                    diag_tile = self.data[diag_tid]
+                    if len(diag_tile.b_vix) == 0:
+                        continue
                     
-                    out_verts = np.vstack((out_verts, verts_geo))
-                    out_tris = np.vstack((out_tris, tris))
+                    curr_vix = curr_tile.t_vix[0] if curr_col == 0 else curr_tile.t_vix[-1]
+                    diag_vix = diag_tile.b_vix[0] if diag_col == 0 else diag_tile.b_vix[-1]
+                    
+                    if (curr_tile.vertices[curr_vix, 1] == curr_col) and (diag_tile.vertices[diag_vix, 1] == diag_col) and (gid[curr_vix] == -1):
+                        gid[curr_vix] = prev_gids[diag_tid][diag_vix]
+                
+                is_new = gid == -1
+                gid[is_new] = np.arange(np.count_nonzero(is_new)) + nr_gids
+                nr_gids += np.count_nonzero(is_new)
+                
+                curr_gids[curr_tid] = gid
+                
+                yield curr_tid, curr_tile, gid, is_new
+            
+            prev_gids = curr_gids
+    
+    def merge_tiles(self, opath):
         
-        o3d_mesh = o3d.geometry.TriangleMesh(vertices=o3d.utility.Vector3dVector(out_verts),
-                                             triangles=o3d.utility.Vector3iVector(out_tris))
-        o3d_mesh.remove_duplicated_vertices()
+        #first pass only counts the vertices and triangles of the merged mesh
+        nr_verts = 0
+        nr_tris = 0
+        for curr_tid, curr_tile, gid, is_new in self.weld_tiles():
+            nr_verts += np.count_nonzero(is_new)
+            nr_tris += curr_tile.nr_triangles
+        
+        ply_header = "\n".join(["ply",
+                                "format binary_little_endian 1.0",
+                                "element vertex %i" % (nr_verts),
+                                "property double x",
+                                "property double y",
+                                "property double z",
+                                "element face %i" % (nr_tris),
+                                "property list uchar int vertex_indices",
+                                "end_header"]) + "\n"
+        ply_header = ply_header.encode("ascii")
+        
+        face_dtype = np.dtype([("n", "u1"), ("vix", "<i4", (3,))])
+        vert_dtype = np.dtype("<f8")
+        
+        verts_start = len(ply_header)
+        tris_start = verts_start + nr_verts * 3 * vert_dtype.itemsize
+        tris_end = tris_start + nr_tris * face_dtype.itemsize
+        
+        with open(opath, "wb") as f:
+            f.write(ply_header)
+            f.truncate(tris_end)
+        
+        #the second pass writes each tile directly to its position in the file; hence, the merged mesh
+        #is never kept in memory as a whole
+        out_verts = np.memmap(opath, dtype=vert_dtype, mode="r+", offset=verts_start, shape=(nr_verts, 3))
+        out_tris = np.memmap(opath, dtype=face_dtype, mode="r+", offset=tris_start, shape=(nr_tris, ))
+        
+        vx = 0
+        tx = 0
+        for ix, (curr_tid, curr_tile, gid, is_new) in enumerate(self.weld_tiles()):
+            self.report("merge", ix+1, len(self.data))
+            
+            verts_geo = curr_tile.vertices_geo()[is_new, :]
+            out_verts[vx:vx+len(verts_geo), :] = verts_geo
+            
+            out_tris["n"][tx:tx+curr_tile.nr_triangles] = 3
+            out_tris["vix"][tx:tx+curr_tile.nr_triangles, :] = gid[curr_tile.triangles]
+            
+            vx += len(verts_geo)
+            tx += curr_tile.nr_triangles
         
-        o3d.io.write_triangle_mesh(opath, o3d_mesh)
\ No newline at end of file
+        out_verts.flush()
+        out_tris.flush()
+        del out_verts, out_tris
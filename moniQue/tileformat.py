@@ -0,0 +1,118 @@
+import numpy as np
+
+#the format of the tiles and of the index in tiles.json is shared by the conversion (terramesh.py) and the 
+#viewer (helpers.py, dlg_main.py); it only depends on numpy; hence, the viewer does not require pymartini
+
+#binary tile container (*.mqt); written by write_tile_bin in terramesh.py and read by read_tile_bin in 
+#helpers.py. The header is followed by the float32 vertices (relative to origin), the float32 uv 
+#coordinates and the uint32 triangle indices. Quantized tiles (flag TILE_BIN_QUANTIZED) store uint16 
+#row/col/height per vertex followed by the delta/zigzag coded triangle indices (varint, idx_nbytes in 
+#total); all sections start at a multiple of 4 bytes. Quantized heights refer to z_range; i.e. the height 
+#range of all tiles of the dgm; hence, a vertex on the seam of two tiles decodes to the same height in both
+TILE_BIN_MAGIC = b"MQT1"
+TILE_BIN_VERSION = 4
+TILE_BIN_QUANTIZED = 1
+TILE_BIN_HEADER = np.dtype([("magic", "S4"),
+                            ("version", "<u4"),
+                            ("flags", "<u4"),
+                            ("nr_vertices", "<u4"),
+                            ("nr_triangles", "<u4"),
+                            ("tid", "<u4", (2,)),
+                            ("max_error", "<f4"),
+                            ("origin", "<f8", (3,)),
+                            ("min_xyz", "<f8", (3,)),
+                            ("max_xyz", "<f8", (3,)),
+                            ("tile_gt", "<f8", (6,)),
+                            ("idx_nbytes", "<u4"),
+                            ("extent", "<f8", (4,)),
+                            ("z_range", "<f8", (2,)),
+                            ("reserved", "u1", (4,))])
+
+def zigzag_encode(tris):
+    
+    #consecutive indices of the martini triangles are close to each other; hence, the differences
+    #are small and zigzag coding maps them to small unsigned integers. Those are stored as varint 
+    #with 7 bits per byte where the highest bit marks that another byte follows
+    delta = np.diff(tris.ravel().astype(np.int64), prepend=0)
+    zz = ((delta << 1) ^ (delta >> 63)).astype(np.uint64)
+    
+    nr_bytes = np.ones(len(zz), dtype=np.int64)
+    for k in range(1, 5):
+        nr_bytes += zz >= (1 << (7*k))
+    
+    start = np.cumsum(nr_bytes) - nr_bytes
+    enc = np.zeros(np.sum(nr_bytes), dtype=np.uint8)
+    
+    for k in range(5):
+        kix = nr_bytes > k
+        enc[start[kix] + k] = ((zz[kix] >> np.uint64(7*k)) & np.uint64(0x7f)) | ((nr_bytes[kix] > k+1) * 0x80).astype(np.uint64)
+    
+    return enc
+
+def zigzag_decode(enc):
+    
+    enc = np.asarray(enc)
+    
+    #each value ends with a byte without the continuation bit; a value has at most 5 bytes
+    end = np.flatnonzero(enc < 0x80)
+    if len(end) == 0:
+        return np.zeros((0, 3), dtype=np.uint32)
+    start = np.concatenate(([0], end[:-1] + 1))
+    nr_bytes = end - start + 1
+    
+    zz = np.zeros(len(start), dtype=np.int64)
+    for k in range(5):
+        kix = nr_bytes > k
+        zz[kix] |= (enc[start[kix] + k] & 0x7f).astype(np.int64) << (7*k)
+    
+    delta = (zz >> 1) ^ -(zz & 1)
+    return np.cumsum(delta).astype(np.uint32).reshape(-1, 3)
+
+def quantize_heights(heights, min_h, max_h):
+    rng = max_h - min_h
+    if rng <= 0:
+        return np.zeros(len(heights), dtype=np.uint16)
+    return np.round((heights - min_h) / rng * 65535).astype(np.uint16)
+
+def build_tile_index(tile_meta_list):
+
+    #quadtree over the r_c grid of the tiles; each node covers a square block of size x size tiles and
+    #holds the merged bounds of the tiles within. Nodes are listed in depth first order; hence, the tiles
+    #below a node are a contiguous range (first, count) of the leaf order.
+    tile_rc = np.array([[int(x) for x in t["tid"].split("_")] for t in tile_meta_list])
+    tile_min = np.array([t["min_xyz"] for t in tile_meta_list])
+    tile_max = np.array([t["max_xyz"] for t in tile_meta_list])
+
+    root_size = 1
+    while root_size < np.max(tile_rc) + 1:
+        root_size *= 2
+
+    nodes = []
+    order = []
+
+    def add_node(r0, c0, size, tixs):
+        nix = len(nodes)
+        node = {"r_c":[r0, c0], "size":size, "first":len(order)}
+        nodes.append(node)
+
+        children = []
+        if size == 1:
+            order.append(int(tile_meta_list[tixs[0]]["tid_int"]))
+        else:
+            half = size // 2
+            for (dr, dc) in [(0, 0), (0, 1), (1, 0), (1, 1)]:
+                cr, cc = r0 + dr*half, c0 + dc*half
+                in_child = (tile_rc[tixs, 0] >= cr) & (tile_rc[tixs, 0] < cr + half) & \
+                           (tile_rc[tixs, 1] >= cc) & (tile_rc[tixs, 1] < cc + half)
+                if np.any(in_child):
+                    children.append(add_node(cr, cc, half, tixs[in_child]))
+
+        node["count"] = len(order) - node["first"]
+        node["children"] = children
+        node["min_xyz"] = np.round(np.min(tile_min[tixs], axis=0), 3).tolist()
+        node["max_xyz"] = np.round(np.max(tile_max[tixs], axis=0), 3).tolist()
+        return nix
+
+    add_node(0, 0, root_size, np.arange(len(tile_meta_list)))
+
+    return {"nodes":nodes, "order":order}
@@ -2,6 +2,7 @@ from qgis.gui import QgsMapTool, QgsRubberBand
 from qgis.core import QgsPointXY, QgsFeature, QgsPoint, QgsGeometry
 from qgis.PyQt.QtCore import Qt
 import open3d as o3d
+import numpy as np
 
 class MonoMapTool(QgsMapTool):
     
@@ -43,8 +44,27 @@ class MonoMapTool(QgsMapTool):
         self.rubberMap_prev.setLineStyle(Qt.DashLine)
         self.rubberMap_prev.reset()
         
-    def set_scene(self, scene):
+    def set_scene(self, scene, dtm_caster=None):
         self.ray_scene = scene
+        self.dtm_caster = dtm_caster
+    
+    def intersect(self, ray):
+        
+        #ray is in global coordinates; the scene and the DTM are relative to min_xyz
+        ray[0, :3] -= self.min_xyz
+        
+        if (self.dtm_caster is not None) and self.dtm_caster.ready():
+            t_hit = self.dtm_caster.cast_rays(ray)[0]
+        else:
+            o3d_ray = o3d.core.Tensor(ray, dtype=o3d.core.Dtype.Float32)
+            t_hit = self.ray_scene.cast_rays(o3d_ray)['t_hit'].numpy()[0]
+        
+        if not np.isfinite(t_hit):
+            return None
+        
+        obj_coord = ray[0, :3] + ray[0, 3:]*t_hit
+        obj_coord += self.min_xyz
+        return obj_coord
         
     def set_layers(self, img_lyr, map_lyr):
         self.img_lyr = img_lyr
@@ -75,14 +95,9 @@ class MonoMapTool(QgsMapTool):
                     
                     #ray is in global coordinates;
                     ray = self.camera.ray(img_x=mx, img_y=my)
-                    ray[0, :3] -= self.min_xyz
-                    o3d_ray = o3d.core.Tensor(ray, dtype=o3d.core.Dtype.Float32)
-                    ans = self.ray_scene.cast_rays(o3d_ray)
+                    obj_coord = self.intersect(ray)
                     
-                    if ans['t_hit'].isfinite():
-                        obj_coord = o3d_ray[0,:3] + o3d_ray[0,3:]*ans['t_hit'].reshape((-1,1))
-                        obj_coord = obj_coord.numpy().ravel()
-                        obj_coord += self.min_xyz
+                    if obj_coord is not None:
                     
                         self.rubberMap.addPoint(QgsPointXY(obj_coord[0], obj_coord[1]), True)
                         self.rubberMap_h.append(obj_coord[2])
@@ -162,19 +177,14 @@ class MonoMapTool(QgsMapTool):
             if (my <= 0) and (my >= self.camera.img_h*(-1)):
                 
                 ray = self.camera.ray(img_x=mx, img_y=my)
-                ray[0, :3] -= self.min_xyz
-                o3d_ray = o3d.core.Tensor(ray, dtype=o3d.core.Dtype.Float32)
-                ans = self.ray_scene.cast_rays(o3d_ray)
+                obj_coord = self.intersect(ray)
 
                 if self.is_drawing:
                     if self.rubberImg_prev.numberOfVertices() == 2:
                         self.rubberImg_prev.removeLastPoint()
                     self.rubberImg_prev.addPoint(QgsPointXY(mx, my), True)
                 
-                if ans['t_hit'].isfinite():
-                    obj_coord = o3d_ray[0,:3] + o3d_ray[0,3:]*ans['t_hit'].reshape((-1,1))
-                    obj_coord = obj_coord.numpy().ravel()
-                    obj_coord += self.min_xyz
+                if obj_coord is not None:
                     
                     if self.rubberRay.numberOfVertices() == 2:
                         self.rubberRay.removeLastPoint()
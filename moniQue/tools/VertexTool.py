@@ -3,6 +3,7 @@ from qgis.core import Qgis, QgsPointXY, QgsRectangle, QgsWkbTypes, QgsPointLocat
 from PyQt5.QtCore import Qt
 from PyQt5.QtGui import QColor
 import open3d as o3d
+import numpy as np
 
 class VertexTool(QgsMapTool):
     
@@ -378,8 +379,9 @@ class VertexTool(QgsMapTool):
 
         return QgsRectangle(self.startPoint, self.endPoint)
 
-    def set_scene(self, scene):
+    def set_scene(self, scene, dtm_caster=None):
         self.ray_scene = scene
+        self.dtm_caster = dtm_caster
     
     def set_camera(self, camera):
         self.camera = camera
@@ -398,12 +400,15 @@ class VertexTool(QgsMapTool):
                 ray = self.camera.ray(img_x=mx, img_y=my)
                 ray[0, :3] -= self.min_xyz
                 
-                o3d_ray = o3d.core.Tensor(ray, dtype=o3d.core.Dtype.Float32)
-                ans = self.ray_scene.cast_rays(o3d_ray)
+                #the DTM gives the exact intersection; the tiles carry the simplification error
+                if (self.dtm_caster is not None) and self.dtm_caster.ready():
+                    t_hit = self.dtm_caster.cast_rays(ray)[0]
+                else:
+                    o3d_ray = o3d.core.Tensor(ray, dtype=o3d.core.Dtype.Float32)
+                    t_hit = self.ray_scene.cast_rays(o3d_ray)['t_hit'].numpy()[0]
                 
-                if ans['t_hit'].isfinite():
-                    obj_coord = o3d_ray[0, :3] + o3d_ray[0, 3:]*ans['t_hit'].reshape((-1,1))
-                    obj_coord = obj_coord.numpy().ravel()
+                if np.isfinite(t_hit):
+                    obj_coord = ray[0, :3] + ray[0, 3:]*t_hit
                     obj_coord[:3] += self.min_xyz
                     return obj_coord
                 else:
@@ -0,0 +1,117 @@
+import numpy as np
+import pytest
+
+gdal = pytest.importorskip("osgeo.gdal")
+osr = pytest.importorskip("osgeo.osr")
+pytest.importorskip("pymartini")
+pytest.importorskip("open3d")
+
+from moniQue.terramesh import MeshGrid
+
+def write_dtm(path, holes=False, size=513, seed=2):
+
+    #smooth random terrain; with holes, nodata discs and a nodata strip across a row of seams leave gaps
+    #in the boundaries of the tiles
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[:size, :size] / size
+    dtm = np.zeros((size, size))
+    for _ in range(20):
+        fx, fy, ph = rng.uniform(1, 12), rng.uniform(1, 12), rng.uniform(0, 2*np.pi)
+        dtm += np.sin(2*np.pi*(fx*xx + fy*yy) + ph) / np.hypot(fx, fy)
+    dtm = (dtm - dtm.min()) / (dtm.max() - dtm.min()) * 300 + 400
+
+    if holes:
+        yy, xx = np.mgrid[:size, :size]
+        for _ in range(12):
+            cy, cx, rad = rng.integers(0, size), rng.integers(0, size), rng.integers(5, 40)
+            dtm[(yy-cy)**2 + (xx-cx)**2 < rad**2] = -9999
+        dtm[300:305, :] = -9999
+
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(31287)
+
+    ds = gdal.GetDriverByName("GTiff").Create(str(path), size, size, 1, gdal.GDT_Float32)
+    ds.SetGeoTransform([100000., 1., 0., 300000., 0., -1.])
+    ds.SetProjection(srs.ExportToWkt())
+    ds.GetRasterBand(1).SetNoDataValue(-9999)
+    ds.GetRasterBand(1).WriteArray(dtm.astype(np.float32))
+    ds = None
+    return str(path)
+
+def snap_loop(self, tid, missing_vix_coords, missing_vix_heights, mode=None):
+
+    #reference for MeshGrid.snap; the triangle of each missing coordinate is searched one by one and the
+    #fans are created per triangle as before the vectorization
+    bdry_trix, bdry_const, bix, not_bix = {"left":(self.data[tid].r_tix, self.tile_size-1, 0, 1),
+                                           "right":(self.data[tid].l_tix, 0, 0, 1),
+                                           "top":(self.data[tid].b_tix, self.tile_size-1, 1, 0),
+                                           "bottom":(self.data[tid].t_tix, 0, 1, 0)}[mode]
+
+    tri_coords = self.data[tid].vertices[self.data[tid].triangles[bdry_trix, :], :].astype(np.int64)
+
+    tri_miss = {}
+    for coord, height in sorted(zip(missing_vix_coords.tolist(), missing_vix_heights.tolist())):
+        for six in range(len(bdry_trix)):
+            on_bdry = tri_coords[six, :, not_bix] == bdry_const
+            if np.min(tri_coords[six, on_bdry, bix]) < coord < np.max(tri_coords[six, on_bdry, bix]):
+                tri_miss.setdefault(six, []).append((coord, height))
+
+    new_verts, new_heights, new_tris, pop_tris = [], [], [], []
+    max_vix = len(self.data[tid].vertices) - 1
+
+    for six in sorted(tri_miss.keys()):
+        miss_coords = np.array([coord for coord, _ in tri_miss[six]])
+        miss_vix = np.arange(max_vix+1, max_vix+1+len(miss_coords))
+
+        for coord, height in tri_miss[six]:
+            new_verts.append([coord, bdry_const] if mode in ["left", "right"] else [bdry_const, coord])
+            new_heights.append(height)
+
+        trix_insert = bdry_trix[six]
+        trix_insert_vix = self.data[tid].triangles[trix_insert, :]
+        trix_insert_vix_coords = self.data[tid].vertices[trix_insert_vix, :]
+        pop_tris.append(trix_insert)
+
+        bdry_ix = np.argwhere(trix_insert_vix_coords[:, not_bix] == bdry_const).ravel()
+        norm_ix = np.setdiff1d(np.arange(3), bdry_ix)
+
+        bdry_coords_ext = np.hstack((trix_insert_vix_coords[bdry_ix, bix], miss_coords))
+        bdry_vix = np.hstack((trix_insert_vix[bdry_ix], miss_vix))[np.argsort(bdry_coords_ext)]
+        norm_vix = trix_insert_vix[norm_ix]
+
+        for bx in range(len(bdry_vix)-1):
+            if mode == "right" or mode == "top":
+                new_tris.append([bdry_vix[bx], bdry_vix[bx+1], norm_vix[0]])
+            else:
+                new_tris.append([bdry_vix[bx], norm_vix[0], bdry_vix[bx+1]])
+
+        max_vix = miss_vix[-1]
+
+    if len(new_verts) == 0:
+        return [], [], [], []
+    return np.array(new_verts), np.array(new_heights), np.array(new_tris), np.array(pop_tris)
+
+def tile_triangles(grid):
+    return {tid:tile.vertices[tile.triangles].astype(np.int64) for tid, tile in grid.data.items()}
+
+@pytest.mark.parametrize("holes", [False, True])
+def test_snap_matches_loop(tmp_path, monkeypatch, holes):
+    path = write_dtm(tmp_path / "dtm.tif", holes=holes)
+
+    grid = MeshGrid(path, tile_size=128, max_error=2.0)
+    grid.snap_boundaries()
+
+    monkeypatch.setattr(MeshGrid, "snap", snap_loop)
+    ref_grid = MeshGrid(path, tile_size=128, max_error=2.0)
+    ref_grid.snap_boundaries()
+
+    tris = tile_triangles(grid)
+    ref_tris = tile_triangles(ref_grid)
+    assert tris.keys() == ref_tris.keys()
+    for tid in tris.keys():
+        assert np.array_equal(tris[tid], ref_tris[tid]), tid
+
+        #snapped triangles keep the orientation of the martini triangles
+        edge_a = tris[tid][:, 1, :] - tris[tid][:, 0, :]
+        edge_b = tris[tid][:, 2, :] - tris[tid][:, 0, :]
+        assert np.all(edge_a[:, 0] * edge_b[:, 1] - edge_a[:, 1] * edge_b[:, 0] > 0), tid